@@ -0,0 +1,139 @@
+"""Resilience scenarios against the /timelines stand-in with injected faults.
+
+Run from the repository root in an environment with Home Assistant installed:
+
+    python -m benchmarks.faults
+
+Each scenario sets up one timeline, injects faults and refreshes it a few
+times, then reports the calls that reached the stand-in, the retries made,
+the refreshes blocked by the circuit breaker and whether data was kept.
+Retry delays are scaled down so the scenarios run in seconds.
+
+The recovery scenario then moves the clock past the breaker cooldown
+twice: the trial call of the first hour still fails, the faults are
+cleared before the second one, which must reach the service again.
+"""
+
+from datetime import timedelta
+
+import asyncio
+import logging
+import tempfile
+
+from benchmarks.run import _create_hass
+
+REFRESHES = 8
+
+# name: (status, count, headers, expected behaviour)
+SCENARIOS = {
+    "429 burst with Retry-After": (429, 2, {"Retry-After": "1"}, "retried"),
+    "503 outage": (503, None, {}, "breaker opens"),
+    "401 invalid key": (401, None, {}, "not retried"),
+    "hourly limit exhausted": (
+        429,
+        None,
+        {"X-RateLimit-Remaining-hour": "0"},
+        "blocked until next hour",
+    ),
+    "503 outage, then recovery": (503, None, {}, "breaker closes again"),
+}
+
+RECOVERY = "503 outage, then recovery"
+
+
+async def run_scenario(name):
+    from benchmarks.timelines_server import TimelinesStandIn
+    import custom_components.climacell.data_provider as data_provider
+    from custom_components.climacell import sensor
+    from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+    import homeassistant.util.dt as dt_util
+
+    logging.getLogger("custom_components.climacell").setLevel(logging.CRITICAL)
+    data_provider._RETRY_DELAY = 0.01
+
+    stand_in = TimelinesStandIn()
+    data_provider._ENDPOINT = await stand_in.start()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = _create_hass(config_dir)
+        config = sensor.PLATFORM_SCHEMA(
+            {
+                "platform": "climacell",
+                "api_key": "faults",
+                "units": "metric",
+                "timelines": [
+                    {
+                        "name": "faults",
+                        "timestep": "1h",
+                        "forecast_observations": 3,
+                        "update": "manual",
+                        "scan_interval": {"seconds": 0},
+                        "fields": ["temperature"],
+                    }
+                ],
+            }
+        )
+
+        entities = []
+        await sensor.async_setup_platform(hass, config, entities.extend)
+        await hass.async_block_till_done()
+        provider = entities[0].coordinator
+
+        status, count, headers, expected = SCENARIOS[name]
+        stand_in.inject(status=status, count=count, headers=headers)
+        calls = stand_in.calls
+        for _ in range(REFRESHES):
+            await provider.async_refresh()
+
+        recovered = None
+        if name == RECOVERY:
+            utcnow = dt_util.utcnow
+            shift = timedelta(0)
+
+            async def refresh_later(shift):
+                dt_util.utcnow = lambda: utcnow() + shift
+                await provider.async_refresh()
+
+            try:
+                # the trial call fails too, with retryable errors
+                shift += timedelta(hours=1)
+                await refresh_later(shift)
+                stand_in.clear_faults()
+                shift += timedelta(hours=1)
+                recovery_calls = stand_in.calls
+                await refresh_later(shift)
+            finally:
+                dt_util.utcnow = utcnow
+            recovered = (
+                stand_in.calls > recovery_calls
+                and not provider.request.breaker.is_open
+            )
+
+        metrics = provider.metrics["request"]
+        result = {
+            "scenario": name,
+            "expected": expected,
+            "calls": stand_in.calls - calls,
+            "retries": metrics["retries"],
+            "breaker_skips": metrics["breaker_skips"],
+            "errors": metrics["errors"],
+            "data_kept": entities[0].state is not None,
+        }
+        if recovered is not None:
+            result["recovered"] = recovered
+        if provider._unsub_refresh is not None:
+            provider._unsub_refresh()
+        hass.bus.async_fire(EVENT_HOMEASSISTANT_CLOSE)
+        await hass.async_block_till_done()
+
+    await stand_in.stop()
+    return result
+
+
+def main():
+    for name in SCENARIOS:
+        print(asyncio.run(run_scenario(name)))
+
+
+if __name__ == "__main__":
+    main()
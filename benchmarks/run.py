@@ -0,0 +1,282 @@
+"""Benchmarks of the climacell sensor platform against a local /timelines stand-in.
+
+Run from the repository root in an environment with Home Assistant installed:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --case 100x10x10 --scans 50
+
+Every case runs in its own process so resident memory is not shared
+between cases. Results are printed as a table, or as JSON lines with
+--json for comparison between releases.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# case name: (timelines, fields per timeline, forecast observations)
+CASES = {
+    "1x5x1": (1, 5, 1),
+    "1x30x48": (1, 30, 48),
+    "10x10x5": (10, 10, 5),
+    "10x10x24": (10, 10, 24),
+    "100x10x1": (100, 10, 1),
+    "100x10x10": (100, 10, 10),
+}
+
+# manual timelines reuse a response younger than the scan interval instead of
+# waiting for the next timestep boundary, so scans spaced by it fetch each time
+SCAN_INTERVAL = 1
+
+TIMESTEPS = ["1h", "1d", "5m", "30m", "current", "15m", "3h", "2d"]
+
+FIELDS = [
+    "temperature",
+    "temperatureApparent",
+    "dewPoint",
+    "humidity",
+    "windSpeed",
+    "windDirection",
+    "windGust",
+    "pressureSurfaceLevel",
+    "pressureSeaLevel",
+    "precipitationIntensity",
+    "precipitationProbability",
+    "precipitationType",
+    "visibility",
+    "cloudCover",
+    "cloudBase",
+    "cloudCeiling",
+    "weatherCode",
+    "particulateMatter25",
+    "particulateMatter10",
+    "pollutantO3",
+    "pollutantNO2",
+    "pollutantCO",
+    "pollutantSO2",
+    "epaIndex",
+    "epaHealthConcern",
+    "epaPrimaryPollutant",
+    "treeIndex",
+    "grassIndex",
+    "weedIndex",
+    "fireIndex",
+]
+
+
+def platform_config(timelines, fields, observations):
+    """A single platform block with timelines spread over timesteps and fields."""
+    return {
+        "platform": "climacell",
+        "api_key": "benchmark",
+        "latitude": 45.0,
+        "longitude": 9.0,
+        "units": "metric",
+        "timelines": [
+            {
+                "name": " bench" + str(index),
+                "timestep": TIMESTEPS[index % len(TIMESTEPS)],
+                "forecast_observations": observations,
+                "update": "manual",
+                "scan_interval": {"seconds": SCAN_INTERVAL},
+                "fields": [
+                    FIELDS[(index * fields + offset) % len(FIELDS)]
+                    for offset in range(fields)
+                ],
+            }
+            for index in range(timelines)
+        ],
+    }
+
+
+def resident_memory():
+    """Resident set size of this process in bytes."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _create_hass(config_dir):
+    from homeassistant.core import HomeAssistant
+
+    try:
+        hass = HomeAssistant(config_dir)
+    except TypeError:
+        hass = HomeAssistant()
+    hass.config.config_dir = config_dir
+    hass.config.latitude = 45.0
+    hass.config.longitude = 9.0
+    return hass
+
+
+async def run_case(name, scans, repeats, latency):
+    from benchmarks.timelines_server import TimelinesStandIn
+    import custom_components.climacell.data_provider as data_provider
+    from custom_components.climacell import sensor
+    from custom_components.climacell.lib import prepare_config
+
+    logging.getLogger("homeassistant.helpers.entity").setLevel(logging.ERROR)
+
+    stand_in = TimelinesStandIn(latency=latency)
+    data_provider._ENDPOINT = await stand_in.start()
+
+    result = {"case": name}
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = _create_hass(config_dir)
+        config = sensor.PLATFORM_SCHEMA(platform_config(*CASES[name]))
+
+        started = time.perf_counter()
+        for _ in range(repeats):
+            prepare_config(hass, copy.deepcopy(config))
+        result["prepare_config_ms"] = (
+            (time.perf_counter() - started) / repeats * 1000
+        )
+
+        entities = []
+
+        def async_add_entities(new_entities, update_before_add=False):
+            entities.extend(new_entities)
+
+        memory = resident_memory()
+        started = time.perf_counter()
+        await sensor.async_setup_platform(hass, config, async_add_entities)
+        result["setup_return_ms"] = (time.perf_counter() - started) * 1000
+        # first fetches run in the background
+        await hass.async_block_till_done()
+        for index, entity in enumerate(entities):
+            entity.hass = hass
+            entity.entity_id = "sensor.bench_" + str(index)
+            await entity.async_added_to_hass()
+            entity.async_write_ha_state()
+        result["setup_platform_ms"] = (time.perf_counter() - started) * 1000
+        result["sensors"] = len(entities)
+        result["rss_per_sensor_bytes"] = (resident_memory() - memory) / max(
+            1, len(entities)
+        )
+        result["setup_calls"] = stand_in.calls
+
+        providers = list(
+            {id(entity.coordinator): entity.coordinator for entity in entities}.values()
+        )
+        result["timelines"] = len(providers)
+
+        latencies = []
+        cpu = 0
+        calls = stand_in.calls
+        for _ in range(scans):
+            await asyncio.sleep(SCAN_INTERVAL)
+            started = time.perf_counter()
+            cpu_started = time.process_time()
+            await asyncio.gather(
+                *(provider.async_refresh() for provider in providers)
+            )
+            cpu += time.process_time() - cpu_started
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        result["scan_p50_ms"] = statistics.median(latencies)
+        result["scan_p99_ms"] = percentile(latencies, 0.99)
+        result["cpu_per_sensor_us"] = (
+            cpu / scans / max(1, len(entities)) * 1000000
+        )
+        result["calls_per_scan"] = (stand_in.calls - calls) / scans
+        result["rss_bytes"] = resident_memory()
+
+        for provider in providers:
+            if provider._unsub_refresh is not None:
+                provider._unsub_refresh()
+
+    await stand_in.stop()
+    return result
+
+
+def _print_table(results):
+    columns = [
+        ("case", "%-10s"),
+        ("timelines", "%9d"),
+        ("sensors", "%8d"),
+        ("prepare_config_ms", "%17.2f"),
+        ("setup_return_ms", "%15.1f"),
+        ("setup_platform_ms", "%17.1f"),
+        ("scan_p50_ms", "%11.2f"),
+        ("scan_p99_ms", "%11.2f"),
+        ("cpu_per_sensor_us", "%17.2f"),
+        ("calls_per_scan", "%14.1f"),
+        ("rss_per_sensor_bytes", "%20.0f"),
+    ]
+    print(
+        " ".join(
+            column.ljust(10) if column == "case" else column for column, _ in columns
+        )
+    )
+    for result in results:
+        print(" ".join(fmt % result[column] for column, fmt in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--case", action="append", choices=sorted(CASES))
+    parser.add_argument("--scans", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    cases = args.case or list(CASES)
+
+    if args.in_process:
+        for name in cases:
+            result = asyncio.run(
+                run_case(name, args.scans, args.repeats, args.latency)
+            )
+            print(json.dumps(result))
+        return
+
+    results = []
+    for name in cases:
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                "--in-process",
+                "--case",
+                name,
+                "--scans",
+                str(args.scans),
+                "--repeats",
+                str(args.repeats),
+                "--latency",
+                str(args.latency),
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        _print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Local stand-in for the Climacell v4 /timelines endpoint."""
+
+from datetime import datetime, timedelta, timezone
+
+import asyncio
+import glob
+import json
+import os
+import random
+
+from aiohttp import web
+
+_PAYLOADS = os.path.join(os.path.dirname(__file__), "payloads")
+
+TIMESTEPS = {
+    "1m": timedelta(minutes=1),
+    "5m": timedelta(minutes=5),
+    "15m": timedelta(minutes=15),
+    "30m": timedelta(minutes=30),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+
+DEFAULT_OBSERVATIONS = {
+    "1m": 360,
+    "5m": 72,
+    "15m": 24,
+    "30m": 12,
+    "1h": 108,
+    "1d": 15,
+}
+
+ENUM_FIELDS = {
+    "epaHealthConcern": 6,
+    "epaPrimaryPollutant": 6,
+    "moonPhase": 8,
+    "precipitationType": 5,
+    "treeIndex": 6,
+    "grassIndex": 6,
+    "weedIndex": 6,
+}
+
+WEATHER_CODES = [1000, 1001, 1100, 1101, 1102, 2000, 4000, 4001, 4200, 5001, 8000]
+
+
+def _format(timestamp):
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse(value):
+    return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S").replace(
+        tzinfo=timezone.utc
+    )
+
+
+def load_payloads():
+    """Recorded responses, indexed by timestep."""
+    payloads = {}
+    for path in sorted(glob.glob(os.path.join(_PAYLOADS, "*.json"))):
+        with open(path) as payload:
+            for timeline in json.load(payload)["data"]["timelines"]:
+                payloads[timeline["timestep"]] = timeline
+    return payloads
+
+
+class TimelinesStandIn:
+    """Serve /v4/timelines from recorded payloads, filling gaps synthetically.
+
+    Values of a recorded timeline are replayed in a loop on a time axis
+    built from the requested window. Fields or timesteps without a
+    recording get deterministic synthetic values.
+    """
+
+    def __init__(self, latency=0, recorded=True, seed=0):
+        self.latency = latency
+        self.payloads = load_payloads() if recorded else {}
+        self.calls = 0
+        self.bytes_sent = 0
+        self.faults = []
+        self.__random = random.Random(seed)
+        self.__runner = None
+        self.endpoint = None
+
+    def __value(self, field, timestamp, index):
+        if field in ENUM_FIELDS:
+            return index % ENUM_FIELDS[field]
+        if field.startswith("weatherCode"):
+            return WEATHER_CODES[index % len(WEATHER_CODES)]
+        if field.endswith("Time"):
+            return _format(timestamp)
+        return round(self.__random.uniform(-10, 40), 2)
+
+    def timelines(self, query):
+        fields = query["fields"].split(",")
+        now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        start = _parse(query["startTime"]) if "startTime" in query else now
+
+        timelines = []
+        for timestep in query["timesteps"].split(","):
+            if timestep == "current":
+                times = [now]
+            else:
+                step = TIMESTEPS[timestep]
+                first = datetime.fromtimestamp(
+                    start.timestamp() // step.total_seconds() * step.total_seconds(),
+                    timezone.utc,
+                )
+                if "endTime" in query:
+                    count = int((_parse(query["endTime"]) - first) / step) + 1
+                else:
+                    count = DEFAULT_OBSERVATIONS[timestep]
+                times = [first + step * index for index in range(count)]
+
+            recorded = self.payloads.get(timestep, {}).get("intervals", [])
+            intervals = []
+            for index, timestamp in enumerate(times):
+                replay = (
+                    recorded[index % len(recorded)]["values"] if recorded else {}
+                )
+                intervals.append(
+                    {
+                        "startTime": _format(timestamp),
+                        "values": {
+                            field: replay[field]
+                            if field in replay
+                            else self.__value(field, timestamp, index)
+                            for field in fields
+                        },
+                    }
+                )
+
+            timelines.append(
+                {
+                    "timestep": timestep,
+                    "startTime": _format(times[0]),
+                    "endTime": _format(times[-1]),
+                    "intervals": intervals,
+                }
+            )
+
+        return {"data": {"timelines": timelines}}
+
+    def inject(self, status=None, count=1, delay=0, headers=None):
+        """Answer the next `count` calls (all with None) with a fault.
+
+        A fault delays the answer by `delay` seconds and replies with the
+        given status and headers (e.g. Retry-After) instead of data.
+        """
+        fault = {"status": status, "delay": delay, "headers": headers or {}}
+        if count is None:
+            self.faults = [dict(fault, sticky=True)]
+        else:
+            self.faults += [fault] * count
+
+    def clear_faults(self):
+        self.faults = []
+
+    async def __handle(self, request):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.faults:
+            fault = self.faults[0]
+            if not fault.get("sticky"):
+                self.faults.pop(0)
+            if fault["delay"]:
+                await asyncio.sleep(fault["delay"])
+            if fault["status"] is not None:
+                return web.Response(
+                    status=fault["status"],
+                    headers=fault["headers"],
+                    text=json.dumps({"code": fault["status"], "type": "Injected"}),
+                    content_type="application/json",
+                )
+        body = json.dumps(self.timelines(request.query))
+        self.bytes_sent += len(body)
+        return web.Response(text=body, content_type="application/json")
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_get("/v4/timelines", self.__handle)
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, "127.0.0.1", port)
+        await site.start()
+        port = self.__runner.addresses[0][1]
+        self.endpoint = "http://127.0.0.1:%d/v4" % port
+        return self.endpoint
+
+    async def stop(self):
+        await self.__runner.cleanup()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0)
+    args = parser.parse_args()
+
+    async def serve():
+        stand_in = TimelinesStandIn(latency=args.latency)
+        print("Serving", await stand_in.start(args.port))
+        while True:
+            await asyncio.sleep(3600)
+
+    asyncio.run(serve())
@@ -1,9 +1,8 @@
 """Support for climacell.co API Version 4"""
 
-import asyncio
+import json
 import logging
 
-
 from homeassistant.core import callback
 
 from custom_components.climacell.data_provider import ClimacellTimelineDataProvider
@@ -13,8 +12,7 @@ DOMAIN = "climacell"
 _LOGGER = logging.getLogger(__name__)
 
 
-@asyncio.coroutine
-def async_setup(hass, config):
+async def async_setup(hass, config):
     _LOGGER.info("__init__ async_setup start for domain %s.", DOMAIN)
 
     @callback
@@ -29,5 +27,22 @@ def async_setup(hass, config):
     # Register our service with Home Assistant.
     hass.services.async_register(DOMAIN, "climacell_weather", climacell_service)
 
+    from custom_components.climacell.registry import get_registry
+
+    @callback
+    def dump_metrics(call):
+        """Log the counters of all timelines as JSON."""
+        _LOGGER.info(
+            "climacell metrics: %s",
+            json.dumps(
+                [
+                    provider.metrics
+                    for provider in get_registry(hass).providers
+                ]
+            ),
+        )
+
+    hass.services.async_register(DOMAIN, "dump_metrics", dump_metrics)
+
     _LOGGER.info("__init__ async_setup done for domain %s.", DOMAIN)
     return True
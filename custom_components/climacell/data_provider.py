@@ -2,125 +2,464 @@ from datetime import datetime
 from datetime import timedelta
 from datetime import time
 
+import asyncio
+import bisect
+import email.utils
+import hashlib
+import json
 import logging
+import math
+import random
+import re
+from types import MappingProxyType
 
-import json
-import requests
-import socket
+import aiohttp
+
+from homeassistant.core import callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+import homeassistant.util.dt as dt_util
 
-from homeassistant.util import Throttle
+from custom_components.climacell.metrics import ClimacellFetchMetrics
+from custom_components.climacell.scheduler import ClimacellExcludeSchedule
+from custom_components.climacell.global_const import (
+    ATTR_AUTO,
+    ATTR_FORECAST,
+    CONF_ALLOWED_UNITS,
+    CONVERSIONS,
+    SUFFIXES,
+    ATTR_OBSERVATION_TIME,
+    ATTRIBUTION,
+)
+from homeassistant.const import ATTR_ATTRIBUTION, ATTR_UNIT_OF_MEASUREMENT
 
 _LOGGER = logging.getLogger(__name__)
 
 ATTR_SERVICE_COUNTER = "service_counter"
 _HOSTNAME = "data.climacell.co"
 _ENDPOINT = "https://" + _HOSTNAME + "/v4"
+_TIMEOUT = aiohttp.ClientTimeout(connect=10.05, sock_read=27)
+_MIN_UPDATE_INTERVAL = timedelta(seconds=300)
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_util.UTC)
+
+_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+# native timesteps of the /timelines endpoint, longest first
+_API_TIMESTEPS = (
+    ("1d", timedelta(days=1)),
+    ("1h", timedelta(hours=1)),
+    ("30m", timedelta(minutes=30)),
+    ("15m", timedelta(minutes=15)),
+    ("5m", timedelta(minutes=5)),
+    ("1m", timedelta(minutes=1)),
+)
+# timesteps fetched incrementally, re-fetching the last _REVALIDATE intervals
+_INCREMENTAL_TIMESTEPS = {
+    "1m": timedelta(minutes=1),
+    "5m": timedelta(minutes=5),
+}
+_REVALIDATE = 3
+
+# unit system of every call, other systems are converted locally
+_FETCH_UNITS = CONF_ALLOWED_UNITS[0]
+
+# refresh periods are doubled after each unchanged response, up to this factor
+_MAX_BACKOFF = 8
+
+# fields only valid for some timesteps (daily aggregates and events); queries
+# asking for them are not merged with other timesteps
+_RESTRICTED_FIELDS = {"sunriseTime", "sunsetTime", "moonPhase"}
+
+# how far ahead each timestep is available
+_HORIZONS = {
+    "1d": timedelta(days=15),
+    "1h": timedelta(hours=108),
+    "30m": timedelta(hours=6),
+    "15m": timedelta(hours=6),
+    "5m": timedelta(hours=6),
+    "1m": timedelta(hours=6),
+}
+
+_STORAGE_VERSION = 1
+_STORAGE_KEY = "climacell."
+_STORAGE_SAVE_DELAY = 10
+# retries of a failed call within one update
+_RETRIES = 3
+_RETRY_DELAY = 2
+_MAX_RETRY_DELAY = 30
+# outcomes of an update of a request
+_FETCHED = "fetched"
+_REUSED = "reused"
+_BLOCKED = "blocked"
+_FAILED = "failed"
+# error responses are logged up to this many bytes
+_LOG_BODY_LENGTH = 300
+
+# seconds new data waits for further updates before it is pushed to the sensors
+_PUBLISH_DELAY = 1
+
+_NUMBER = re.compile(r"^-?\d+(?:\.\d+)?$")
+_INTEGER = re.compile("^[1-9][0-9]{0,2}(?:,[0-9]{3}){0,3}$")
+
+
+def _decode(value):
+    """Convert numeric strings, as sent by some layers, to numbers."""
+    if type(value) == str and _NUMBER.match(value) is not None:
+        if _INTEGER.match(value) is not None:
+            return int(value)
+        return float(value)
+    return value
+
+
+class ClimacellTimeline:
+    """Columnar form of a /timelines timeline, built once per fetch.
+
+    Values are kept as one list per field and observation times are
+    converted to local time up front, so sensors read them by index.
+    """
+
+    __slots__ = ("start_times", "observation_times", "values", "__attributes")
+
+    def __init__(self, start_times, observation_times, values):
+        self.start_times = start_times
+        self.observation_times = observation_times
+        self.values = values
+        self.__attributes = {}
+
+    @classmethod
+    def from_response(cls, timeline):
+        intervals = timeline["intervals"]
+
+        start_times = [
+            dt_util.parse_datetime(interval["startTime"]) for interval in intervals
+        ]
+        observation_times = [
+            dt_util.as_local(start_time.replace(second=0, microsecond=0)).isoformat()
+            for start_time in start_times
+        ]
+
+        fields = {}
+        for interval in intervals:
+            fields.update(dict.fromkeys(interval["values"]))
+        values = {
+            field: [
+                _decode(interval["values"].get(field)) for interval in intervals
+            ]
+            for field in fields
+        }
+
+        return cls(start_times, observation_times, values)
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def splice(self, first, last, tail):
+        """Observations first to last (excluded) followed by those of tail."""
+        kept = slice(first, last)
+        return ClimacellTimeline(
+            self.start_times[kept] + tail.start_times,
+            self.observation_times[kept] + tail.observation_times,
+            {
+                field: self.values.get(field, [None] * len(self))[kept]
+                + tail.values.get(field, [None] * len(tail))
+                for field in {**self.values, **tail.values}
+            },
+        )
+
+    def attributes(self, observation, unit):
+        """State attributes shared by all sensors of an observation and unit."""
+        key = (observation, unit)
+        attributes = self.__attributes.get(key)
+        if attributes is None:
+            attributes = self.__attributes[key] = MappingProxyType(
+                {
+                    ATTR_ATTRIBUTION: ATTRIBUTION,
+                    ATTR_OBSERVATION_TIME: self.observation_times[observation],
+                    ATTR_UNIT_OF_MEASUREMENT: unit,
+                }
+            )
+        return attributes
+
+    def fingerprint(self):
+        """Cheap hash of the start times and values."""
+        return hash(
+            (
+                tuple(self.start_times),
+                tuple((field, tuple(column)) for field, column in self.values.items()),
+            )
+        )
+
+    def changes(self, previous):
+        """Observations of each field whose value or time differ from previous."""
+        count = len(self)
+        moved = {
+            observation
+            for observation in range(max(count, len(previous)))
+            if observation >= count
+            or observation >= len(previous)
+            or self.observation_times[observation]
+            != previous.observation_times[observation]
+        }
+        changes = {}
+        for field, column in self.values.items():
+            old_column = previous.values.get(field)
+            if old_column is None:
+                changes[field] = moved.union(range(count))
+                continue
+            changes[field] = moved.union(
+                observation
+                for observation, (value, old_value) in enumerate(
+                    zip(column, old_column)
+                )
+                if value != old_value
+            )
+        return changes
+
+    def series_attributes(self, field, unit):
+        """State attributes of a series sensor: the whole column of a field.
 
+        The forecast is a list of [observation time, value] pairs.
+        """
+        key = (field, unit)
+        attributes = self.__attributes.get(key)
+        if attributes is None:
+            attributes = self.__attributes[key] = MappingProxyType(
+                {
+                    ATTR_ATTRIBUTION: ATTRIBUTION,
+                    ATTR_OBSERVATION_TIME: self.observation_times[0],
+                    ATTR_UNIT_OF_MEASUREMENT: unit,
+                    ATTR_FORECAST: [
+                        [observation_time, value]
+                        for observation_time, value in zip(
+                            self.observation_times, self.values[field]
+                        )
+                    ],
+                }
+            )
+        return attributes
+
+    def convert_units(self, conversions):
+        """Convert metric columns with their scale, offset and decimals."""
+        for field, (scale, offset, decimals) in conversions.items():
+            if field in self.values:
+                self.values[field] = [
+                    round(value * scale + offset, decimals)
+                    if isinstance(value, (int, float))
+                    else value
+                    for value in self.values[field]
+                ]
+
+    def map_values(self, value_maps):
+        """Decode enum columns through their integer keyed value tables."""
+        for field, value_map in value_maps.items():
+            if field in self.values:
+                self.values[field] = [
+                    value_map.get(value, value) for value in self.values[field]
+                ]
+
+    def view(self, start, step, count, fields):
+        """Slice the observations and restrict the columns to the given fields.
+
+        Fields missing from the response get a column of None.
+        """
+        observations = slice(
+            start, None if count is None else start + step * count, step
+        )
+        start_times = self.start_times[observations]
+        return ClimacellTimeline(
+            start_times,
+            self.observation_times[observations],
+            {
+                field: self.values[field][observations]
+                if field in self.values
+                else [None] * len(start_times)
+                for field in fields
+            },
+        )
+
+
+class ClimacellTimelinesRequest:
+    """One /timelines call shared by all timelines of a location."""
 
-class ClimacellTimelineDataProvider:
     def __init__(
         self,
+        hass,
         api_key,
         latitude,
         longitude,
-        interval,
         units,
         fields,
         start_time,
-        timesteps,
-        observations,
-        exceptions=None,
+        end_delta,
+        quota,
+        breaker,
         inc_counter=1,
     ):
-        self.__name = "timeline"
+        self.__name = "timelines"
         self.__update_timestamp = datetime.today()
         self.__service_counter = 0
         self.__inc_counter = inc_counter
 
-        self.__interval = interval
-        self.__exceptions = exceptions
-
-        self.__throttle_user_update = Throttle(interval)(self._user_update)
-        self.__throttle_update = Throttle(timedelta(seconds=300))(
-            self.__update_controller
-        )
-
-        self.__api_key = api_key
-        self.__latitude = latitude
-        self.__longitude = longitude
-        self.__fields = ",".join(fields)
-        self.__observations = observations
+        self.__hass = hass
+        self.__session = async_get_clientsession(hass)
+        self.__fields = fields
         self.__start_time = start_time
-        self.__units = units
+        self.__end_delta = end_delta
+        self.__timesteps = []
+        self.__intervals = []
 
-        if timesteps == 'current':
-            self.__timesteps_suffix = 'current'
-            self.__timesteps_int = ''
-            self.__observations = None
-            self.__start_time = 0
-        else:
-            self.__timesteps_suffix = timesteps[-1]
-            self.__timesteps_int = int(timesteps[:-1])
-
-        self.__take_every = 1
-
-        if self.__timesteps_suffix == "m":
-            if self.__timesteps_int % 60 == 0:
-                self.__timesteps_suffix = "h"
-                self.__timesteps_int = 1
-                self.__take_every = int(self.__timesteps_int / 60)
-            elif self.__timesteps_int % 30 == 0:
-                self.__take_every = int(self.__timesteps_int / 30)
-                self.__timesteps_int = 30
-            elif self.__timesteps_int % 5 == 0:
-                self.__take_every = int(self.__timesteps_int / 5)
-                self.__timesteps_int = 5
-            else:
-                self.__take_every = self.__timesteps_int
-                self.__timesteps_int = 1
-
-        if self.__timesteps_suffix == "h":
-            if self.__timesteps_int % 24 == 0:
-                self.__timesteps_suffix = "d"
-                self.__timesteps_int = 1
-                self.__take_every = int(self.__timesteps_int / 24)
-            else:
-                self.__take_every = self.__timesteps_int
-                self.__timesteps_int = 1
-
-        if self.__timesteps_suffix == "d":
-            self.__take_every = self.__timesteps_int
-            self.__timesteps_int = 1
-
-        """Initialize the data object."""
-        self.data = None
+        self.__quota = quota
+        self.__quota.add_request(self)
+        self.__breaker = breaker
 
         self.__headers = {
             "Content-Type": "application/json",
             "apikey": api_key,
         }
 
-        self._params = (
+        self.__params = (
             "location="
             + str(latitude)
             + ","
             + str(longitude)
             + "&units="
-            + self.__units
-            + "&timesteps="
-            + str(self.__timesteps_int)
-            + self.__timesteps_suffix
+            + units
         )
 
-        _LOGGER.debug(
-            "ClimacellTimelineDataProvider initializated for: %s.", self.__fields
+        self.__fetch_timestamp = None
+        self.__timelines = []
+        self.__columns = {}
+        self.__store = None
+        self.__metrics = ClimacellFetchMetrics()
+        self.__in_flight = None
+        self.__fingerprint = None
+
+    @property
+    def start_time(self):
+        return self.__start_time
+
+    @property
+    def end_delta(self):
+        return self.__end_delta
+
+    @property
+    def fields(self):
+        return self.__fields
+
+    @property
+    def fetch_timestamp(self):
+        return self.__fetch_timestamp
+
+    def add_timestep(self, timestep):
+        if timestep not in self.__timesteps:
+            self.__timesteps.append(timestep)
+
+    def add_consumer(self, interval):
+        """Register a timeline; interval is None for manually updated ones."""
+        self.__intervals.append(interval)
+
+    def remove_consumer(self, interval):
+        """Unregister a timeline and return the number of timelines left."""
+        self.__intervals.remove(interval)
+        return len(self.__intervals)
+
+    @property
+    def interval(self):
+        """Shortest scan interval of the scheduled timelines using this request."""
+        intervals = [interval for interval in self.__intervals if interval is not None]
+        if len(intervals) == 0:
+            return None
+        return max(min(intervals), _MIN_UPDATE_INTERVAL)
+
+    @property
+    def quota(self):
+        return self.__quota
+
+    @property
+    def breaker(self):
+        return self.__breaker
+
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    @property
+    def timesteps(self):
+        return self.__timesteps
+
+    @property
+    def backoff(self):
+        """Factor stretching the refresh period after unchanged responses."""
+        return min(2 ** self.__metrics.unchanged_fetches, _MAX_BACKOFF)
+
+    def __record_fingerprint(self):
+        """Count the consecutive fetches returning the same data."""
+        fingerprint = hash(
+            tuple(
+                (timestep, columns.fingerprint())
+                for timestep, columns in self.__columns.items()
+            )
         )
+        if fingerprint == self.__fingerprint:
+            self.__metrics.unchanged_fetches += 1
+        else:
+            self.__metrics.unchanged_fetches = 0
+        self.__fingerprint = fingerprint
 
-    @staticmethod
-    def __is_between(time, time_range):
-        if time_range[1] < time_range[0]:
-            return time >= time_range[0] or time <= time_range[1]
-        return time_range[0] <= time <= time_range[1]
+    def timeline(self, timestep):
+        return self.__columns.get(timestep)
+
+    def __ingest(self, timelines):
+        # built aside and swapped in without awaiting, so readers on the
+        # event loop see either the previous or the new snapshot
+        columns = {
+            timeline["timestep"]: ClimacellTimeline.from_response(timeline)
+            for timeline in timelines
+        }
+        self.__timelines = timelines
+        self.__columns = columns
+
+    def __tail_start(self, window_start):
+        """Start of the next call: the whole window, or only its new tail.
+
+        A single minute timestep that already covers the window start is
+        continued from its last interval, re-fetching the last few ones in
+        case they were revised.
+        """
+        if len(self.__timesteps) != 1 or self.__end_delta is None:
+            return window_start
+        step = _INCREMENTAL_TIMESTEPS.get(self.__timesteps[0])
+        timeline = self.__columns.get(self.__timesteps[0])
+        if step is None or timeline is None or len(timeline) == 0:
+            return window_start
+        if timeline.start_times[-1] < window_start:
+            return window_start
+        return max(window_start, timeline.start_times[-1] - step * _REVALIDATE)
+
+    def __splice(self, timelines, window_start):
+        """Shift the window: drop intervals before it, append the new tail."""
+        tail = timelines[0]
+        timestep = tail["timestep"]
+        step = _INCREMENTAL_TIMESTEPS[timestep]
+        previous = self.__columns[timestep]
+        columns = ClimacellTimeline.from_response(tail)
+        if len(columns) == 0:
+            return
+
+        first = bisect.bisect_right(previous.start_times, window_start - step)
+        last = bisect.bisect_left(previous.start_times, columns.start_times[0])
+        raw = self.__timelines[0]
+        self.__timelines = [
+            dict(tail, intervals=raw["intervals"][first:last] + tail["intervals"])
+        ]
+        self.__columns = {timestep: previous.splice(first, last, columns)}
+        _LOGGER.debug(
+            "ClimacellTimelinesRequest kept %s intervals of %s, fetched %s.",
+            last - first,
+            timestep,
+            len(columns),
+        )
 
     def __reset_service_counter(self):
         self.__update_timestamp = datetime.today()
@@ -157,93 +496,877 @@ class ClimacellTimelineDataProvider:
     def _set_service_counter_update_timestamp(self, val):
         self.__update_timestamp = val
 
-    def retrieve_update(self):
-        self.__throttle_update()
+    def __cache_params(self):
+        return (
+            self.__params
+            + "&timesteps="
+            + ",".join(self.__timesteps)
+            + "&fields="
+            + self.__fields
+            + "&startTime="
+            + str(self.__start_time)
+            + "&endTime="
+            + str(self.__end_delta)
+        )
+
+    async def async_restore(self):
+        """Load the cached response on first use and return its fetch time."""
+        if self.__store is None:
+            await self.__async_load_cache()
+        return self.__fetch_timestamp
 
-    def __update_controller(self):
-        """"""
-        now = datetime.now()
-        hourminute = "" + str(now.hour) + ":" + str(now.minute)
+    async def __async_load_cache(self):
+        """Restore the last response stored for the same query."""
+        params = self.__cache_params()
+        self.__store = Store(
+            self.__hass,
+            _STORAGE_VERSION,
+            _STORAGE_KEY + hashlib.sha1(params.encode()).hexdigest(),
+        )
 
-        update = True
+        cached = await self.__store.async_load()
+        if cached is None or cached.get("params") != params:
+            return
 
-        if self.__exceptions is not None:
-            for key, value in self.__exceptions[0].items():
-                if self.__is_between(hourminute, value):
-                    update = False
+        self.__ingest(cached["timelines"])
+        self.__fetch_timestamp = dt_util.parse_datetime(cached["timestamp"])
+        self.__metrics.cache_restores += 1
+        _LOGGER.debug(
+            "ClimacellTimelinesRequest restored data of %s for timesteps %s.",
+            self.__fetch_timestamp,
+            self.__timesteps,
+        )
 
-        if update:
-            updt_state = self.__throttle_user_update()
-            if updt_state:
-                self.__inc_service_counter()
+    def __cache_data(self):
+        return {
+            "params": self.__cache_params(),
+            "timestamp": self.__fetch_timestamp.isoformat(),
+            "timelines": self.__timelines,
+        }
 
-    def _user_update(self):
-        """Get the latest data from climacell"""
+    async def async_retrieve(self, max_age):
+        """Fetch all timesteps unless another timeline refreshed them recently.
+
+        Return _FETCHED when new data was received, _REUSED when the current
+        data was reused, _BLOCKED when the circuit breaker of the API key
+        blocked the call and _FAILED when the call failed; the current data
+        is kept in the last two cases. Timelines calling while a fetch is
+        running wait for it and reuse its data.
+        """
+        if self.__in_flight is not None and not self.__in_flight.done():
+            result = await asyncio.shield(self.__in_flight)
+            return _REUSED if result == _FETCHED else result
+
+        self.__in_flight = asyncio.ensure_future(self.__async_retrieve(max_age))
+        return await asyncio.shield(self.__in_flight)
 
-        if self.__fields is not "":
-            querystring = self._params
-            querystring += "&fields=" + self.__fields
+    async def __async_retrieve(self, max_age):
+        await self.async_restore()
 
-            if self.__start_time != 0:
-                start_time_obj = datetime.now() + timedelta(minutes=self.__start_time)
-                start_time_obj = start_time_obj.replace(microsecond=0, tzinfo=None)
-                querystring += "&startTime=" + start_time_obj.isoformat() + "Z"
+        now = dt_util.utcnow()
+        if (
+            self.__fetch_timestamp is not None
+            and now - self.__fetch_timestamp < max_age
+        ):
+            _LOGGER.debug(
+                "ClimacellTimelinesRequest reuse data of %s for timesteps %s.",
+                self.__fetch_timestamp,
+                self.__timesteps,
+            )
+            return _REUSED
+
+        querystring = self.__params
+        querystring += "&timesteps=" + ",".join(self.__timesteps)
+        querystring += "&fields=" + self.__fields
+
+        window_start = None
+        start_time_obj = None
+        if self.__start_time != 0 or self.__end_delta is not None:
+            window_start = now + timedelta(minutes=self.__start_time)
+            window_start = window_start.replace(microsecond=0)
+            start_time_obj = self.__tail_start(window_start)
+            querystring += (
+                "&startTime=" + start_time_obj.replace(tzinfo=None).isoformat() + "Z"
+            )
+
+            if self.__end_delta is not None:
+                end_time = window_start.replace(tzinfo=None) + self.__end_delta
+                querystring += "&endTime=" + end_time.isoformat() + "Z"
+
+        url = _ENDPOINT + "/timelines"
+        for attempt in range(_RETRIES + 1):
+            if not self.__breaker.allow():
+                self.__metrics.breaker_skips += 1
+                _LOGGER.debug(
+                    "ClimacellTimelinesRequest call for %s blocked for %s.",
+                    self.__timesteps,
+                    self.__breaker.retry_in(),
+                )
+                return _BLOCKED
+
+            result, retry, wait_until = await self.__async_retrieve_data(
+                url, self.__headers, querystring, attempt
+            )
+            self.__inc_service_counter()
+            self.__quota.record_call()
 
-                if self.__observations is not None:
-                    time_delta = self.__timesteps_int * (
-                        self.__observations * self.__take_every
-                    )
-                    if self.__timesteps_suffix == "m":
-                        end_time = start_time_obj + timedelta(minutes=time_delta)
-                    elif self.__timesteps_suffix == "h":
-                        end_time = start_time_obj + timedelta(hours=time_delta)
-                    elif self.__timesteps_suffix == "d":
-                        end_time = start_time_obj + timedelta(days=time_delta)
+            if result is not None:
+                self.__breaker.record_success()
+                if start_time_obj is not None and start_time_obj > window_start:
+                    self.__splice(result, window_start)
+                else:
+                    self.__ingest(result)
+                self.__fetch_timestamp = now
+                self.__record_fingerprint()
+                self.__store.async_delay_save(self.__cache_data, _STORAGE_SAVE_DELAY)
+                return _FETCHED
 
-                    querystring += "&endTime=" + end_time.isoformat() + "Z"
+            delay = _backoff(attempt)
+            if wait_until is not None:
+                delay = (wait_until - dt_util.utcnow()).total_seconds()
+            # a failed trial call ends the update, reopening the breaker
+            if (
+                not retry
+                or attempt == _RETRIES
+                or delay > _MAX_RETRY_DELAY
+                or self.__breaker.in_trial
+            ):
+                self.__breaker.record_failure(wait_until)
+                return _FAILED
 
-            url = _ENDPOINT + "/timelines"
-            self.data = self.__retrieve_data(url, self.__headers, querystring)
+            _LOGGER.debug(
+                "ClimacellTimelinesRequest retry %s for %s in %.1fs.",
+                attempt + 1,
+                self.__timesteps,
+                delay,
+            )
+            self.__metrics.retries += 1
+            await asyncio.sleep(max(0, delay))
 
-        return True
+    async def __async_retrieve_data(self, url, headers, querystring, attempt=0):
+        """Make one call.
 
-    def __retrieve_data(self, url, headers, querystring):
-        result = self.data
+        Return the timelines, or None with whether the call may be retried
+        and the time the API asked to wait until.
+        """
+        result = None
+        retry = True
+        wait_until = None
+        loop = self.__hass.loop
+        # repeated failures of the same update are not worth an error each
+        log_error = _LOGGER.error if attempt == 0 else _LOGGER.debug
 
         try:
             _LOGGER.debug(
-                "ClimacellTimelineDataProvider:_retrieve_data url: %s - headers: %s - querystring: %s",
+                "ClimacellTimelinesRequest:_retrieve_data url: %s - querystring: %s",
                 url,
-                self.__headers,
                 querystring,
             )
 
-            response = requests.request(
-                "GET",
+            started = loop.time()
+            async with self.__session.get(
                 url,
                 headers=headers,
                 params=querystring,
-                timeout=(10.05, 27),
-                verify=True,
-            )
+                timeout=_TIMEOUT,
+            ) as response:
+                body = await response.read()
+            self.__metrics.record_response(loop.time() - started, len(body))
 
-            if response.status_code == 200:
-                result = json.loads(response.text)
-                result = result["data"]["timelines"][0]
-                result["intervals"] = result["intervals"][:: self.__take_every]
-                _LOGGER.debug("_retrieve_data response.text: %s", response.text)
+            if response.status == 200:
+                started = loop.time()
+                result = json.loads(body)["data"]["timelines"]
+                self.__metrics.record_parse(loop.time() - started)
+                _LOGGER.debug(
+                    "_retrieve_data response: %s bytes in %s ms, parsed in %s ms",
+                    self.__metrics.response_bytes,
+                    self.__metrics.latency_ms,
+                    self.__metrics.parse_ms,
+                )
             else:
-                _LOGGER.error(
-                    "ClimacellTimelineDataProvider._retrieve_data error status_code %s. Response text: %s",
-                    response.status_code,
-                    response.text
+                self.__metrics.record_error(response.status)
+                retry = response.status == 429 or response.status >= 500
+                wait_until = _wait_until(response.headers)
+                log_error(
+                    "ClimacellTimelinesRequest._retrieve_data error status_code %s. Response text: %s",
+                    response.status,
+                    body[:_LOG_BODY_LENGTH].decode(errors="replace"),
                 )
 
-        except socket.error as err:
-            _LOGGER.error(
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            self.__metrics.record_error(type(err).__name__)
+            log_error(
                 "Unable to connect to Climatecell '%s' while try to retrieve data from %s.",
                 err,
                 url,
             )
+        except (ValueError, KeyError, TypeError) as err:
+            self.__metrics.record_error("invalid_response")
+            retry = False
+            log_error(
+                "Invalid response from Climatecell '%s' while try to retrieve data from %s.",
+                err,
+                url,
+            )
+
+        return result, retry, wait_until
+
+
+def _backoff(attempt):
+    """Exponential backoff with full jitter, in seconds."""
+    return random.uniform(0, _RETRY_DELAY * 2 ** attempt)
+
+
+def _wait_until(headers):
+    """Time until which the API asked not to be called, if any.
+
+    Retry-After may be given in seconds or as an HTTP date. An exhausted
+    rate limit (X-RateLimit-Remaining-<window> of 0) waits for the next
+    window.
+    """
+    now = dt_util.utcnow()
+    wait_until = None
+
+    retry_after = headers.get("Retry-After")
+    if retry_after is not None:
+        if retry_after.strip().isdigit():
+            wait_until = now + timedelta(seconds=int(retry_after))
+        else:
+            try:
+                wait_until = email.utils.parsedate_to_datetime(retry_after)
+                if wait_until.tzinfo is None:
+                    wait_until = wait_until.replace(tzinfo=dt_util.UTC)
+            except (TypeError, ValueError):
+                pass
+
+    for window, reset in (
+        ("second", now.replace(microsecond=0) + timedelta(seconds=1)),
+        ("hour", now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)),
+        (
+            "day",
+            now.replace(hour=0, minute=0, second=0, microsecond=0)
+            + timedelta(days=1),
+        ),
+    ):
+        if headers.get("X-RateLimit-Remaining-" + window) == "0":
+            wait_until = reset if wait_until is None else max(wait_until, reset)
+
+    return wait_until
+
+
+class ClimacellRequestPlanner:
+    """Merge compatible timelines into as few /timelines requests as possible.
+
+    Timelines with the same timestep are fetched with the union of their
+    fields over the smallest window covering all of them. The resulting
+    per-timestep queries are then merged into one request with the union of
+    their fields when they share API key, location and time window; queries
+    starting now are merged regardless of their end and fetched up to the
+    latest one. Queries with fields not valid for every timestep
+    (aggregate suffixes, sunrise, sunset, moon phase) keep a request of their
+    own.
+    1m and 5m queries always get a request of their own, which is then
+    refreshed incrementally. All calls are made in metric units, so timelines
+    of any unit system share them.
+    """
+
+    def __init__(self, hass, quota, breaker):
+        self.__hass = hass
+        self.__quota = quota
+        self.__breaker = breaker
+        self.__timelines = []
+        self.__requests = {}
+
+    def register(
+        self,
+        data_provider,
+        api_key,
+        latitude,
+        longitude,
+        fields,
+        start_time,
+        end_delta,
+        timestep,
+    ):
+        self.__timelines.append(
+            (
+                data_provider,
+                (api_key, latitude, longitude, timestep),
+                fields,
+                start_time,
+                end_delta,
+            )
+        )
+
+    def plan(self):
+        by_timestep = {}
+        for timeline in self.__timelines:
+            by_timestep.setdefault(timeline[1], []).append(timeline)
+
+        queries = {}
+        for key, timelines in by_timestep.items():
+            api_key, latitude, longitude, timestep = key
+
+            fields = []
+            for timeline in timelines:
+                fields += [field for field in timeline[2] if field not in fields]
+
+            start_time = min(timeline[3] for timeline in timelines)
+            end_delta = None
+            if all(timeline[4] is not None for timeline in timelines):
+                end_delta = max(
+                    timedelta(minutes=timeline[3] - start_time) + timeline[4]
+                    for timeline in timelines
+                )
+
+            # queries starting now share a call even when their windows differ;
+            # nowcast timesteps and queries with restricted fields get their
+            # own call
+            own_call = timestep in _INCREMENTAL_TIMESTEPS or any(
+                _restricted(field) for field in fields
+            )
+            query_key = (
+                api_key,
+                latitude,
+                longitude,
+                start_time,
+                None if start_time == 0 else end_delta,
+                timestep if own_call else None,
+            )
+            queries.setdefault(query_key, []).append(
+                (timestep, fields, end_delta, timelines)
+            )
+
+        for query_key, members in queries.items():
+            api_key, latitude, longitude, start_time, _, _ = query_key
+
+            fields = []
+            for member in members:
+                fields += [field for field in member[1] if field not in fields]
+
+            end_delta = _merge_windows(members)
+
+            # identical queries of earlier plans (other platform blocks) share
+            # the request and its cache
+            request_key = query_key + (
+                end_delta,
+                tuple(member[0] for member in members),
+                tuple(fields),
+            )
+            request = self.__requests.get(request_key)
+            if request is None:
+                request = ClimacellTimelinesRequest(
+                    hass=self.__hass,
+                    api_key=api_key,
+                    latitude=latitude,
+                    longitude=longitude,
+                    units=_FETCH_UNITS,
+                    fields=",".join(fields),
+                    start_time=start_time,
+                    end_delta=end_delta,
+                    quota=self.__quota,
+                    breaker=self.__breaker,
+                )
+                for member in members:
+                    request.add_timestep(member[0])
+                self.__requests[request_key] = request
+
+            for member in members:
+                for timeline in member[3]:
+                    timeline[0].attach(request)
+
+        self.__timelines = []
+
+    def release(self, data_provider):
+        """Detach a timeline, dropping its request when nobody else uses it."""
+        request = data_provider.detach()
+        if request is None:
+            return
+        for key, value in list(self.__requests.items()):
+            if value is request:
+                del self.__requests[key]
+        self.__quota.remove_request(request)
+
+    @property
+    def requests(self):
+        return list(self.__requests.values())
+
+
+def _restricted(field):
+    """Whether a field is not valid for every timestep."""
+    return field in _RESTRICTED_FIELDS or any(
+        field.endswith(suffix) for suffix in SUFFIXES
+    )
+
+
+def _merge_windows(members):
+    """Window of a request covering the windows of all its queries.
+
+    Each window is already clipped to the horizon of its timestep, the
+    service clips the longer ones of the other timesteps. The default window
+    is only used when a query needs it; current conditions have no window.
+    """
+    end_deltas = [member[2] for member in members if member[0] != "current"]
+    if len(end_deltas) == 0 or None in end_deltas:
+        return None
+    return max(end_deltas)
+
+
+def _plan_timestep(timestep):
+    """Cheapest native API timestep for a configured one.
+
+    Return the API timestep, its length and how many API intervals make
+    one configured step: the longest native timestep dividing the
+    configured one, e.g. 180m is fetched as 1h taking every 3rd interval.
+    """
+    if timestep == "current":
+        return "current", None, 1
+
+    suffix = timestep[-1]
+    length = timedelta(**{_UNITS[suffix]: int(timestep[:-1])})
+    for api_timestep, api_step in _API_TIMESTEPS:
+        if length % api_step == timedelta(0):
+            return api_timestep, api_step, length // api_step
+
+
+def _plan_window(api_timestep, api_step, take_every, observations, start_time):
+    """Tightest endTime, relative to startTime, covering all observations.
+
+    The last interval used starts (observations - 1) * take_every steps
+    after the first one; one extra minute keeps it when the service treats
+    endTime as exclusive. The window is clipped to the forecast horizon.
+    """
+    if api_step is None or observations is None:
+        return None
+
+    end_delta = api_step * ((observations - 1) * take_every) + timedelta(minutes=1)
+    horizon = _HORIZONS[api_timestep] - timedelta(minutes=start_time)
+    if horizon <= timedelta(0):
+        return None
+    return min(end_delta, horizon)
+
+
+def _view_start(start_times, fetch_timestamp, start_time, api_step):
+    """Index of the first interval of a timeline starting later than its request.
+
+    Intervals ending before its own startTime were fetched for other
+    timelines of the request.
+    """
+    return bisect.bisect_right(
+        start_times, fetch_timestamp + timedelta(minutes=start_time) - api_step
+    )
+
+
+class ClimacellTimelineDataProvider(DataUpdateCoordinator):
+    """Fetch one timeline on its own schedule and push it to its sensors."""
+
+    def __init__(
+        self,
+        hass,
+        planner,
+        name,
+        api_key,
+        latitude,
+        longitude,
+        interval,
+        units,
+        fields,
+        start_time,
+        timesteps,
+        observations,
+        exceptions=None,
+        update=ATTR_AUTO,
+        value_maps=None,
+        lag=timedelta(0),
+        jitter=timedelta(0),
+        max_staleness=None,
+        expire_after=None,
+    ):
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=name,
+            update_interval=max(interval, _MIN_UPDATE_INTERVAL)
+            if update == ATTR_AUTO
+            else None,
+        )
+
+        self.__interval = interval
+        self.__exclude = ClimacellExcludeSchedule(
+            hass,
+            [value for ranges in exceptions or [] for value in ranges.values()],
+        )
+        self.__update = update
+        self.__lag = lag
+        self.__jitter = jitter
+        self.__max_staleness = max_staleness
+        self.__expire_after = expire_after
+        self.__value_maps = {} if value_maps is None else value_maps
+        self.__conversions = CONVERSIONS[units]
+
+        self.__fields = list(fields)
+        self.__observations = observations
+        self.__start_time = start_time
+
+        if timesteps == "current":
+            self.__observations = None
+            self.__start_time = 0
+
+        self.__api_timestep, self.__api_step, self.__take_every = _plan_timestep(
+            timesteps
+        )
+        end_delta = _plan_window(
+            self.__api_timestep,
+            self.__api_step,
+            self.__take_every,
+            self.__observations,
+            self.__start_time,
+        )
+
+        self.__updates = 0
+        self.__update_ms = None
+        self.__cache_hits = 0
+        self.__throttle_skips = 0
+
+        self.__published = None
+        self.__published_success = None
+        self.__published_expired = None
+        self.__changes = None
+        self.__pending = {}
+        self.__unsub_publish = None
+        self.__entities = {}
+        self.__expired = None
+        self.__unsub_expiry = None
+
+        self.__request = None
+        if len(self.__fields) > 0:
+            planner.register(
+                self,
+                api_key=api_key,
+                latitude=latitude,
+                longitude=longitude,
+                fields=self.__fields,
+                start_time=self.__start_time,
+                end_delta=end_delta,
+                timestep=self.__api_timestep,
+            )
+
+        _LOGGER.debug(
+            "ClimacellTimelineDataProvider initializated for: %s.", self.__fields
+        )
+
+    def attach(self, request):
+        self.__request = request
+        request.add_consumer(self.__consumer_interval)
+
+    def detach(self):
+        """Stop using the request; return it when no timeline uses it anymore."""
+        request, self.__request = self.__request, None
+        if self.__unsub_publish is not None:
+            self.__unsub_publish()
+            self.__unsub_publish = None
+        if self.__unsub_expiry is not None:
+            self.__unsub_expiry()
+            self.__unsub_expiry = None
+        self.__pending = {}
+        if request is None or request.remove_consumer(self.__consumer_interval):
+            return None
+        return request
+
+    @property
+    def __consumer_interval(self):
+        return self.__interval if self.__update == ATTR_AUTO else None
+
+    @property
+    def service_counter(self):
+        return 0 if self.__request is None else self.__request.service_counter
+
+    @property
+    def service_counter_update_timestamp(self):
+        return (
+            None
+            if self.__request is None
+            else self.__request.service_counter_update_timestamp
+        )
+
+    @property
+    def request(self):
+        return self.__request
+
+    @property
+    def request_metrics(self):
+        return None if self.__request is None else self.__request.metrics
+
+    @property
+    def metrics(self):
+        """Structured dump of this timeline's counters and of its request."""
+        request_metrics = self.request_metrics
+        return {
+            "timeline": self.name,
+            "timestep": self.__api_timestep,
+            "update_interval": None
+            if self.update_interval is None
+            else self.update_interval.total_seconds(),
+            "updates": self.__updates,
+            "update_ms": self.__update_ms,
+            "cache_hits": self.__cache_hits,
+            "throttle_skips": self.__throttle_skips,
+            "request": None if request_metrics is None else request_metrics.as_dict(),
+        }
+
+    @property
+    def cache_hits(self):
+        return self.__cache_hits
+
+    @property
+    def throttle_skips(self):
+        return self.__throttle_skips
+
+    @callback
+    def async_schedule_write(self, entity):
+        """Write the state of an entity in the next push of this timeline.
+
+        Entities are notified of new data as usual and queue here; the push
+        happens once the updates in quick succession settled and only
+        writes the entities whose data changed.
+        """
+        self.__pending[id(entity)] = entity
+        if self.__unsub_publish is None:
+            self.__unsub_publish = async_call_later(
+                self.hass, _PUBLISH_DELAY, self.__async_publish
+            )
+
+    @callback
+    def async_add_entity(self, entity):
+        self.__entities[id(entity)] = entity
+
+    @callback
+    def async_remove_entity(self, entity):
+        self.__entities.pop(id(entity), None)
+        self.__pending.pop(id(entity), None)
+
+    @callback
+    def __async_publish(self, _now):
+        self.__unsub_publish = None
+        data = self.data
+        success = self.last_update_success
+        expired = self.expired
+        if (
+            data is None
+            or self.__published is None
+            or success != self.__published_success
+            or expired != self.__published_expired
+        ):
+            self.__changes = None
+        else:
+            self.__changes = data.changes(self.__published)
+        self.__published = data
+        self.__published_success = success
+        self.__published_expired = expired
+
+        pending, self.__pending = self.__pending, {}
+        for entity in pending.values():
+            if entity.data_changed():
+                entity.async_write_ha_state()
+        self.__schedule_expiry()
+
+    @property
+    def expired(self):
+        """Whether the data is older than the expiry, not counting excluded time.
+
+        Checked by the entities without a refresh, so that manually updated
+        timelines expire too.
+        """
+        if self.__request is None or self.__request.fetch_timestamp is None:
+            return False
+        now = dt_util.utcnow()
+        fetch_timestamp = self.__request.fetch_timestamp
+        if self.__expired is None or self.__expired[0] != fetch_timestamp:
+            self.__expired = (fetch_timestamp, fetch_timestamp + self.__expiry())
+        if now <= self.__expired[1]:
+            return False
+        return self.__remaining(now) < timedelta(0)
+
+    def __remaining(self, now):
+        """Time left before the data expires."""
+        fetch_timestamp = self.__request.fetch_timestamp
+        age = now - fetch_timestamp
+        expiry = self.__expiry()
+        if age > expiry:
+            age -= self.__exclude.excluded_time(fetch_timestamp, now)
+        return expiry - age
+
+    def __schedule_expiry(self):
+        """Write the entities again when the current data expires."""
+        if self.__unsub_expiry is not None:
+            self.__unsub_expiry()
+            self.__unsub_expiry = None
+        if self.__request is None or self.__request.fetch_timestamp is None:
+            return
+        remaining = self.__remaining(dt_util.utcnow())
+        if remaining < timedelta(0):
+            return
+        # excluded time only stretches the expiry, checked again when due
+        self.__unsub_expiry = async_call_later(
+            self.hass, remaining.total_seconds() + 1, self.__async_expire
+        )
+
+    @callback
+    def __async_expire(self, _now):
+        self.__unsub_expiry = None
+        if not self.expired:
+            self.__schedule_expiry()
+            return
+        _LOGGER.debug("%s data expired.", self.name)
+        self.__published_expired = True
+        for entity in self.__entities.values():
+            entity.async_write_ha_state()
+
+    def changed(self, field=None, observation=None):
+        """Whether the last push changed the field (at the observation).
+
+        Everything counts as changed on the first push and when the
+        availability of the data changed.
+        """
+        if self.__changes is None:
+            return True
+        if field is None:
+            return any(self.__changes.values())
+        observations = self.__changes.get(field)
+        if observations is None:
+            return True
+        if observation is None:
+            return len(observations) > 0
+        return observation in observations
+
+    def __period(self):
+        """Refresh period on a grid that contains the API timestep boundaries.
+
+        Periods longer than the timestep are rounded up to a multiple of it,
+        shorter ones to an even division of it, so that every refresh at a
+        grid point follows the publication of new intervals. The period
+        grows while the responses do not change.
+        """
+        period = self.__request.quota.interval(
+            max(self.__interval, _MIN_UPDATE_INTERVAL)
+        ) * self.__request.backoff
+        step = self.__api_step
+        if step is None:
+            return period
+        if period >= step:
+            return step * math.ceil(period / step)
+        return step / math.floor(step / period)
+
+    def __last_refresh_point(self, now, period):
+        """Latest grid point (boundary plus lag) at or before now."""
+        elapsed = now - self.__lag - _EPOCH
+        return _EPOCH + self.__lag + period * math.floor(elapsed / period)
+
+    def __schedule(self, next_refresh):
+        """Point the coordinator at the next refresh."""
+        self.update_interval = max(
+            next_refresh - dt_util.utcnow(), self.__request.breaker.retry_in()
+        )
+
+    def __expiry(self):
+        """Age after which data is no longer shown, three periods by default."""
+        if self.__expire_after is not None:
+            return self.__expire_after
+        if self.__update == ATTR_AUTO:
+            return 3 * self.__period()
+        return 3 * max(self.__interval, _MIN_UPDATE_INTERVAL)
+
+    def __age(self):
+        fetch_timestamp = self.__request.fetch_timestamp
+        if fetch_timestamp is None:
+            return None
+        return dt_util.utcnow() - fetch_timestamp
+
+    async def async_restore(self):
+        """Publish the cached data at once if it is recent enough.
+
+        The refresh that follows replaces it in the background
+        (stale-while-revalidate).
+        """
+        if self.__request is None or self.data is not None:
+            return
+        await self.__request.async_restore()
+
+        timeline = self.__request.timeline(self.__api_timestep)
+        age = self.__age()
+        if timeline is None or age is None or age > self.__expiry():
+            return
+        if self.__max_staleness is not None and age > self.__max_staleness:
+            return
+
+        _LOGGER.debug("%s serves cached data %s old.", self.name, age)
+        self.async_set_updated_data(self.__view(timeline))
+
+    async def _async_update_data(self):
+        """Get the latest data from climacell"""
+        if self.__request is None:
+            return self.data
+
+        max_age = self.__interval
+        if self.__update == ATTR_AUTO:
+            now = dt_util.utcnow()
+            period = self.__period()
+            # data fetched since the last grid point already has its intervals
+            last_refresh = self.__last_refresh_point(now, period)
+            max_age = now - last_refresh
+            # spread the instances refreshing at the same grid point
+            jitter = self.__jitter * random.random()
+            self.__schedule(last_refresh + period + jitter)
+
+        if self.data is not None and self.__exclude.is_excluded():
+            _LOGGER.debug("%s update skipped by exclude_interval.", self.name)
+            self.__throttle_skips += 1
+            return self.data
+
+        outcome = await self.__request.async_retrieve(max_age)
+        if outcome == _REUSED:
+            self.__cache_hits += 1
+        elif outcome == _FAILED:
+            _LOGGER.debug(
+                "%s update failed, data of %s is kept until it expires.",
+                self.name,
+                self.__request.fetch_timestamp,
+            )
+
+        if self.__update == ATTR_AUTO:
+            # the response may have changed the back-off
+            period = self.__period()
+            self.__schedule(self.__last_refresh_point(now, period) + period + jitter)
 
+        timeline = self.__request.timeline(self.__api_timestep)
+        if timeline is None:
+            raise UpdateFailed("no data for timestep " + self.__api_timestep)
+        if self.expired:
+            raise UpdateFailed(
+                "data of timestep %s expired, fetched at %s"
+                % (self.__api_timestep, self.__request.fetch_timestamp)
+            )
+
+        started = self.hass.loop.time()
+        result = self.__view(timeline)
+        self.__update_ms = round((self.hass.loop.time() - started) * 1000, 2)
+        self.__updates += 1
+        return result
+
+    def __view(self, timeline):
+        """Restrict a shared timeline to this timeline's window and fields."""
+        start = 0
+        if self.__start_time > self.__request.start_time:
+            start = _view_start(
+                timeline.start_times,
+                self.__request.fetch_timestamp,
+                self.__start_time,
+                self.__api_step,
+            )
+
+        result = timeline.view(
+            start, self.__take_every, self.__observations, self.__fields
+        )
+        result.convert_units(self.__conversions)
+        result.map_values(self.__value_maps)
         return result
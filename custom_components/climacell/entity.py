@@ -0,0 +1,40 @@
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from custom_components.climacell.registry import get_registry
+
+
+class ClimacellEntity(CoordinatorEntity):
+    """Entity holding a reference to its shared provider while added."""
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        get_registry(self.hass).retain(self.coordinator)
+        self.coordinator.async_add_entity(self)
+
+    async def async_will_remove_from_hass(self):
+        await super().async_will_remove_from_hass()
+        self.coordinator.async_remove_entity(self)
+        get_registry(self.hass).release(self.coordinator)
+
+    @property
+    def available(self):
+        """Unavailable until the first data arrived and once it expired."""
+        return (
+            self.coordinator.data is not None
+            and not self.coordinator.expired
+            and super().available
+        )
+
+    @callback
+    def _handle_coordinator_update(self):
+        """Queue the state write in the next push of the provider."""
+        self.coordinator.async_schedule_write(self)
+
+    def data_changed(self):
+        """Whether the last push of the provider changed this entity."""
+        return True
+
+    async def async_update(self):
+        """Refresh in the background while the current data stays shown."""
+        self.hass.async_create_task(self.coordinator.async_request_refresh())
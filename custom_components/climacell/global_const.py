@@ -10,6 +10,17 @@ from homeassistant.components.weather import (
     ATTR_WEATHER_WIND_SPEED,
     ATTR_FORECAST_PRECIPITATION,
     ATTR_FORECAST_PRECIPITATION_PROBABILITY,
+    ATTR_CONDITION_CLOUDY,
+    ATTR_CONDITION_FOG,
+    ATTR_CONDITION_HAIL,
+    ATTR_CONDITION_LIGHTNING_RAINY,
+    ATTR_CONDITION_PARTLYCLOUDY,
+    ATTR_CONDITION_POURING,
+    ATTR_CONDITION_RAINY,
+    ATTR_CONDITION_SNOWY,
+    ATTR_CONDITION_SNOWY_RAINY,
+    ATTR_CONDITION_SUNNY,
+    ATTR_CONDITION_WINDY,
 )
 
 from homeassistant.const import (
@@ -21,9 +32,12 @@ from homeassistant.const import (
 
 DEFAULT_NAME = "Climacell"
 DEFAULT_SCAN_INTERVAL = timedelta(seconds=300)
+DEFAULT_REFRESH_LAG = timedelta(seconds=60)
+DEFAULT_REFRESH_JITTER = timedelta(seconds=60)
 
 ATTRIBUTION = "Powered by Climacell"
 ATTR_OBSERVATION_TIME = "observation_time"
+ATTR_FORECAST = "forecast"
 
 CONF_UNITS = "units"
 CONF_ALLOWED_UNITS = ["metric", "imperial"]
@@ -41,6 +55,14 @@ CONF_EXCLUDE_INTERVAL = "exclude_interval"
 CONF_TIMELINES = "timelines"
 CONF_FIELDS = "fields"
 CONF_START_TIME = "start_time"
+CONF_REFRESH_LAG = "refresh_lag"
+CONF_REFRESH_JITTER = "refresh_jitter"
+CONF_MAX_STALENESS = "max_staleness"
+CONF_EXPIRE_AFTER = "expire_after"
+CONF_DAILY_LIMIT = "daily_limit"
+CONF_HOURLY_LIMIT = "hourly_limit"
+CONF_DIAGNOSTICS = "diagnostics"
+CONF_SERIES = "series"
 
 CONF_UPDATE = "update"
 ATTR_AUTO = "auto"
@@ -98,6 +120,7 @@ UPDATE_MODES = {
 ATTR_API_SUFFIX = "api_suffix"
 ATTR_SUFFIX_NAME = "suffix_name"
 ATTR_CONDITION = "condition"
+ATTR_VALUE_MAP = "value_map"
 
 SUFFIXES = {
     "Min": "Minimum",
@@ -957,3 +980,67 @@ UNITS = {
     CONF_ALLOWED_UNITS[0]: METRIC_UNITS,
     CONF_ALLOWED_UNITS[1]: IMPERIAL_UNITS,
 }
+
+# scale, offset and decimals converting a metric value to the unit of another
+# system; decimals keep the significant digits of small values
+UNIT_CONVERSIONS = {
+    ("Celcius", "Fahrenheit"): (1.8, 32, 2),
+    ("km", "mi"): (0.621371, 0, 3),
+    ("m/s", "mph"): (2.23694, 0, 2),
+    ("mm/hr", "in/hr"): (1 / 25.4, 0, 4),
+    ("hPa", "inHg"): (0.02953, 0, 3),
+    ("μg/m^3", "μg/ft^3"): (0.0283168, 0, 4),
+    ("W/m^2", "Btu/ft^2"): (0.316998, 0, 2),
+}
+
+# Fields fetched in metric units and converted locally, by unit system
+CONVERSIONS = {
+    system: {
+        field + suffix: UNIT_CONVERSIONS[(METRIC_UNITS[field], unit)]
+        for (field, unit) in units.items()
+        if not isinstance(unit, dict)
+        and (METRIC_UNITS.get(field), unit) in UNIT_CONVERSIONS
+        for suffix in ("", "Min", "Max", "Avg")
+    }
+    for (system, units) in UNITS.items()
+}
+
+# Enum fields decoded through integer keyed tables instead of string lookups
+VALUE_MAPS = {
+    system: {
+        field: {int(code): label for (code, label) in unit.items()}
+        for (field, unit) in units.items()
+        if isinstance(unit, dict)
+    }
+    for (system, units) in UNITS.items()
+}
+
+# weatherCode to Home Assistant weather condition, used by the weather platform
+WEATHER_CONDITIONS = {
+    1000: ATTR_CONDITION_SUNNY,
+    1100: ATTR_CONDITION_SUNNY,
+    1101: ATTR_CONDITION_PARTLYCLOUDY,
+    1102: ATTR_CONDITION_CLOUDY,
+    1001: ATTR_CONDITION_CLOUDY,
+    2000: ATTR_CONDITION_FOG,
+    2100: ATTR_CONDITION_FOG,
+    3000: ATTR_CONDITION_WINDY,
+    3001: ATTR_CONDITION_WINDY,
+    3002: ATTR_CONDITION_WINDY,
+    4000: ATTR_CONDITION_RAINY,
+    4001: ATTR_CONDITION_RAINY,
+    4200: ATTR_CONDITION_RAINY,
+    4201: ATTR_CONDITION_POURING,
+    5000: ATTR_CONDITION_SNOWY,
+    5001: ATTR_CONDITION_SNOWY,
+    5100: ATTR_CONDITION_SNOWY,
+    5101: ATTR_CONDITION_SNOWY,
+    6000: ATTR_CONDITION_SNOWY_RAINY,
+    6001: ATTR_CONDITION_SNOWY_RAINY,
+    6200: ATTR_CONDITION_SNOWY_RAINY,
+    6201: ATTR_CONDITION_SNOWY_RAINY,
+    7000: ATTR_CONDITION_HAIL,
+    7101: ATTR_CONDITION_HAIL,
+    7102: ATTR_CONDITION_HAIL,
+    8000: ATTR_CONDITION_LIGHTNING_RAINY,
+}
@@ -31,13 +31,18 @@ _LOGGER = logging.getLogger(__name__)
 
 def _prepare_timeline_spec(timeline_spec, config):
     timeline_spec.setdefault(CONF_SCAN_INTERVAL,DEFAULT_SCAN_INTERVAL)
+    timeline_spec.setdefault(CONF_REFRESH_LAG,DEFAULT_REFRESH_LAG)
+    timeline_spec.setdefault(CONF_REFRESH_JITTER,DEFAULT_REFRESH_JITTER)
+    timeline_spec.setdefault(CONF_MAX_STALENESS,None)
+    timeline_spec.setdefault(CONF_EXPIRE_AFTER,None)
+    timeline_spec.setdefault(CONF_SERIES,False)
     fields = timeline_spec.setdefault(CONF_FIELDS,[])
     timeline_spec.setdefault(CONF_START_TIME,0)
     observations = int(timeline_spec.get(CONF_FORECAST_OBSERVATIONS,1))
 
     if timeline_spec.get(CONF_TIMESTEP,'') == 'current':
         observations = 1
-    elif not re.match('^[0-9]+[mhd]$',timeline_spec.get(CONF_TIMESTEP,'')) :
+    elif not re.match('^[1-9][0-9]*[mhd]$',timeline_spec.get(CONF_TIMESTEP,'')) :
         _LOGGER.error("Invalid timestep: %s, using 1d instead", timeline_spec.get(CONF_TIMESTEP,''))
         timeline_spec[CONF_TIMESTEP]="1d"
     
@@ -82,9 +87,11 @@ def _prepare_timeline_spec(timeline_spec, config):
         name = CLIMACELL_FIELDS[field][ATTR_NAME] + suffix_name
        
         unit = UNITS[config.get(CONF_UNITS)].get(field)
+        value_map = VALUE_MAPS[config.get(CONF_UNITS)].get(field)
 
         if raw and isinstance(unit, dict):
             unit = None
+            value_map = None
             name = RAW_PREFIX + " " + name
 
         api_fields[field + suffix] = {
@@ -92,6 +99,7 @@ def _prepare_timeline_spec(timeline_spec, config):
             ATTR_NAME: name,
             ATTR_CONDITION: CLIMACELL_FIELDS[field][ATTR_CONDITION],
             ATTR_ICON: CLIMACELL_FIELDS[field][ATTR_ICON],
+            ATTR_VALUE_MAP: value_map,
         }
 
     timeline_spec[CONF_FIELDS]=api_fields
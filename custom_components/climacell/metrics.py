@@ -0,0 +1,70 @@
+import bisect
+
+import homeassistant.util.dt as dt_util
+
+# upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class ClimacellFetchMetrics:
+    """Counters of the /timelines calls made by one request."""
+
+    def __init__(self):
+        self.calls = 0
+        self.latency_ms = None
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.response_bytes = None
+        self.response_bytes_total = 0
+        self.parse_ms = None
+        self.errors = {}
+        self.cache_restores = 0
+        self.retries = 0
+        self.breaker_skips = 0
+        self.unchanged_fetches = 0
+        self.last_success = None
+
+    def record_response(self, latency, size):
+        self.calls += 1
+        self.latency_ms = round(latency * 1000, 1)
+        self.latency_histogram[bisect.bisect_left(LATENCY_BUCKETS, self.latency_ms)] += 1
+        self.response_bytes = size
+        self.response_bytes_total += size
+
+    def record_parse(self, duration):
+        self.parse_ms = round(duration * 1000, 2)
+        self.last_success = dt_util.utcnow()
+
+    def record_error(self, status):
+        """Count a failed call by HTTP status or by exception name."""
+        self.errors[status] = self.errors.get(status, 0) + 1
+
+    @property
+    def error_count(self):
+        return sum(self.errors.values())
+
+    @property
+    def seconds_since_success(self):
+        if self.last_success is None:
+            return None
+        return int((dt_util.utcnow() - self.last_success).total_seconds())
+
+    def as_dict(self):
+        bounds = ["<=" + str(bound) for bound in LATENCY_BUCKETS]
+        bounds.append(">" + str(LATENCY_BUCKETS[-1]))
+        return {
+            "calls": self.calls,
+            "latency_ms": self.latency_ms,
+            "latency_histogram_ms": dict(zip(bounds, self.latency_histogram)),
+            "response_bytes": self.response_bytes,
+            "response_bytes_total": self.response_bytes_total,
+            "parse_ms": self.parse_ms,
+            "errors": {str(status): count for status, count in self.errors.items()},
+            "cache_restores": self.cache_restores,
+            "retries": self.retries,
+            "breaker_skips": self.breaker_skips,
+            "unchanged_fetches": self.unchanged_fetches,
+            "last_success": None
+            if self.last_success is None
+            else self.last_success.isoformat(),
+            "seconds_since_success": self.seconds_since_success,
+        }
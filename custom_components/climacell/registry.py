@@ -0,0 +1,184 @@
+import asyncio
+import logging
+
+from custom_components.climacell import DOMAIN
+from custom_components.climacell.data_provider import (
+    ClimacellRequestPlanner,
+    ClimacellTimelineDataProvider,
+)
+from custom_components.climacell.global_const import *
+from homeassistant.components.google_assistant import CONF_API_KEY
+from homeassistant.const import (
+    CONF_LATITUDE,
+    CONF_LONGITUDE,
+    CONF_NAME,
+    CONF_SCAN_INTERVAL,
+)
+from custom_components.climacell.scheduler import (
+    ClimacellCircuitBreaker,
+    ClimacellQuotaScheduler,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+ATTR_REGISTRY = "registry"
+
+# requests fetched at the same time while setting up
+_SETUP_CONCURRENCY = 4
+
+
+def get_registry(hass):
+    data = hass.data.setdefault(DOMAIN, {})
+    if ATTR_REGISTRY not in data:
+        data[ATTR_REGISTRY] = ClimacellRegistry(hass)
+    return data[ATTR_REGISTRY]
+
+
+async def async_first_refresh(data_providers):
+    """Fetch the first data of new timelines without delaying the setup.
+
+    Cached data is published first where recent enough. Requests are
+    fetched concurrently, at most _SETUP_CONCURRENCY at a time;
+    the timelines sharing a request refresh one after the other so that
+    only the first one calls the API.
+    """
+    semaphore = asyncio.Semaphore(_SETUP_CONCURRENCY)
+
+    for data_provider in data_providers:
+        await data_provider.async_restore()
+
+    by_request = {}
+    for data_provider in data_providers:
+        by_request.setdefault(id(data_provider.request), []).append(data_provider)
+
+    async def refresh(providers):
+        async with semaphore:
+            for data_provider in providers:
+                await data_provider.async_refresh()
+
+    await asyncio.gather(*(refresh(providers) for providers in by_request.values()))
+
+
+class ClimacellRegistry:
+    """Objects shared by all climacell platform blocks, kept in hass.data.
+
+    Quota, circuit breaker and request planner are kept per API key.
+    Timelines configured identically in several blocks share one provider,
+    handed out with a reference count held by the entities using it. The
+    key of a provider starts with its API key.
+    """
+
+    def __init__(self, hass):
+        self.__hass = hass
+        self.__quotas = {}
+        self.__breakers = {}
+        self.__planners = {}
+        self.__providers = {}
+        self.__keys = {}
+        self.__references = {}
+
+    def quota(self, api_key):
+        if api_key not in self.__quotas:
+            self.__quotas[api_key] = ClimacellQuotaScheduler(api_key)
+        return self.__quotas[api_key]
+
+    def breaker(self, api_key):
+        if api_key not in self.__breakers:
+            self.__breakers[api_key] = ClimacellCircuitBreaker(api_key)
+        return self.__breakers[api_key]
+
+    def planner(self, api_key):
+        if api_key not in self.__planners:
+            self.__planners[api_key] = ClimacellRequestPlanner(
+                self.__hass, self.quota(api_key), self.breaker(api_key)
+            )
+        return self.__planners[api_key]
+
+    @property
+    def providers(self):
+        return list(self.__providers.values())
+
+    def provider(self, key, factory):
+        """Return the provider registered under key, creating it if needed.
+
+        The second value tells whether the provider was created.
+        """
+        if key in self.__providers:
+            _LOGGER.debug("Timeline %s shared.", self.__providers[key].name)
+            return self.__providers[key], False
+        provider = factory()
+        self.__providers[key] = provider
+        self.__keys[id(provider)] = key
+        self.__references[key] = 0
+        return provider, True
+
+    def timeline_provider(self, config, timeline_spec, value_maps, platform):
+        """Return the provider of a prepared timeline, creating it if needed.
+
+        Providers are not shared between platforms, which decode values
+        through different value maps.
+        """
+        api_key = config.get(CONF_API_KEY)
+        key = (
+            api_key,
+            config.get(CONF_LATITUDE),
+            config.get(CONF_LONGITUDE),
+            config.get(CONF_UNITS),
+            tuple(timeline_spec[CONF_FIELDS]),
+            timeline_spec[CONF_TIMESTEP],
+            timeline_spec[CONF_START_TIME],
+            timeline_spec[CONF_FORECAST_OBSERVATIONS],
+            timeline_spec[CONF_SCAN_INTERVAL],
+            timeline_spec[CONF_UPDATE],
+            repr(timeline_spec[CONF_EXCLUDE_INTERVAL]),
+            timeline_spec[CONF_REFRESH_LAG],
+            timeline_spec[CONF_REFRESH_JITTER],
+            timeline_spec[CONF_MAX_STALENESS],
+            timeline_spec[CONF_EXPIRE_AFTER],
+            platform,
+        )
+        return self.provider(
+            key,
+            lambda: ClimacellTimelineDataProvider(
+                hass=self.__hass,
+                planner=self.planner(api_key),
+                name=timeline_spec[CONF_NAME] + " " + timeline_spec[CONF_TIMESTEP],
+                api_key=api_key,
+                latitude=config.get(CONF_LATITUDE),
+                longitude=config.get(CONF_LONGITUDE),
+                interval=timeline_spec[CONF_SCAN_INTERVAL],
+                units=config.get(CONF_UNITS),
+                fields=timeline_spec[CONF_FIELDS].keys(),
+                start_time=timeline_spec[CONF_START_TIME],
+                observations=timeline_spec[CONF_FORECAST_OBSERVATIONS],
+                timesteps=timeline_spec[CONF_TIMESTEP],
+                exceptions=timeline_spec[CONF_EXCLUDE_INTERVAL],
+                update=timeline_spec[CONF_UPDATE],
+                lag=timeline_spec[CONF_REFRESH_LAG],
+                jitter=timeline_spec[CONF_REFRESH_JITTER],
+                max_staleness=timeline_spec[CONF_MAX_STALENESS],
+                expire_after=timeline_spec[CONF_EXPIRE_AFTER],
+                value_maps=value_maps,
+            ),
+        )
+
+    def retain(self, provider):
+        key = self.__keys.get(id(provider))
+        if key is not None:
+            self.__references[key] += 1
+
+    def release(self, provider):
+        """Drop a reference; the last one unregisters the provider."""
+        key = self.__keys.get(id(provider))
+        if key is None:
+            return
+        self.__references[key] -= 1
+        if self.__references[key] > 0:
+            return
+
+        _LOGGER.debug("Timeline %s released.", provider.name)
+        del self.__providers[key]
+        del self.__keys[id(provider)]
+        del self.__references[key]
+        # provider keys start with the API key
+        self.planner(key[0]).release(provider)
@@ -0,0 +1,342 @@
+from datetime import timedelta
+
+import logging
+import re
+
+from homeassistant.helpers.sun import get_astral_event_date
+import homeassistant.util.dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAX_COOLDOWN = timedelta(minutes=30)
+
+_MINUTES_PER_DAY = 24 * 60
+# days of minute tables kept, and looked back when measuring excluded time
+_EXCLUDE_DAYS = 8
+_TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+_SUN = re.compile(r"^(sunrise|sunset)([+-]\d+)?$")
+_WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+_ALL_WEEKDAYS = (1 << 7) - 1
+
+
+class ClimacellQuotaScheduler:
+    """Pace all requests of an API key to stay within the plan limits.
+
+    Calls are counted per UTC day and hour. The refresh interval of every
+    timeline is stretched by the ratio between the calls its requests would
+    make until the next reset and the calls left in the budget, so the
+    intervals grow as the budget runs low and shrink back after the reset.
+    """
+
+    def __init__(self, api_key):
+        self.__api_key = api_key
+        self.__daily_limit = None
+        self.__hourly_limit = None
+        self.__requests = []
+
+        self.__day = None
+        self.__hour = None
+        self.__daily_calls = 0
+        self.__hourly_calls = 0
+
+    def set_limits(self, daily_limit=None, hourly_limit=None):
+        """Apply the plan limits, keeping the lowest when set more than once."""
+        if daily_limit is not None:
+            self.__daily_limit = (
+                daily_limit
+                if self.__daily_limit is None
+                else min(self.__daily_limit, daily_limit)
+            )
+        if hourly_limit is not None:
+            self.__hourly_limit = (
+                hourly_limit
+                if self.__hourly_limit is None
+                else min(self.__hourly_limit, hourly_limit)
+            )
+
+    def add_request(self, request):
+        self.__requests.append(request)
+
+    def remove_request(self, request):
+        self.__requests.remove(request)
+
+    @property
+    def daily_calls(self):
+        self.__roll(dt_util.utcnow())
+        return self.__daily_calls
+
+    @property
+    def hourly_calls(self):
+        self.__roll(dt_util.utcnow())
+        return self.__hourly_calls
+
+    def __roll(self, now):
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        if self.__hour != hour:
+            self.__hour = hour
+            self.__hourly_calls = 0
+        if self.__day != hour.date():
+            self.__day = hour.date()
+            self.__daily_calls = 0
+
+    def record_call(self):
+        self.__roll(dt_util.utcnow())
+        self.__daily_calls += 1
+        self.__hourly_calls += 1
+
+    def __demand(self):
+        """Planned calls per second of all scheduled requests of this key."""
+        return sum(
+            1 / request.interval.total_seconds()
+            for request in self.__requests
+            if request.interval is not None
+        )
+
+    def interval(self, base):
+        """Stretch a timeline's base interval to fit the remaining budget."""
+        now = dt_util.utcnow()
+        self.__roll(now)
+
+        hour_end = self.__hour + timedelta(hours=1)
+        day_end = self.__hour.replace(hour=0) + timedelta(days=1)
+
+        factor = 1
+        for limit, calls, reset in (
+            (self.__daily_limit, self.__daily_calls, day_end),
+            (self.__hourly_limit, self.__hourly_calls, hour_end),
+        ):
+            if limit is None:
+                continue
+
+            remaining = limit - calls
+            if remaining <= 0:
+                _LOGGER.debug(
+                    "Quota of %s exhausted (%s calls), next refresh at %s.",
+                    self.__api_key[-4:],
+                    calls,
+                    reset,
+                )
+                return max(base, reset - now)
+
+            planned = self.__demand() * (reset - now).total_seconds()
+            factor = max(factor, planned / remaining)
+
+        if factor > 1:
+            _LOGGER.debug(
+                "Quota of %s running low (day %s/%s, hour %s/%s), interval stretched by %.2f.",
+                self.__api_key[-4:],
+                self.__daily_calls,
+                self.__daily_limit,
+                self.__hourly_calls,
+                self.__hourly_limit,
+                factor,
+            )
+        return base * factor
+
+
+class ClimacellCircuitBreaker:
+    """Stop calling the API with a key after repeated failures.
+
+    After `threshold` consecutive failures, or when the API asks to wait
+    (Retry-After, exhausted rate limit), the breaker opens and no call is
+    made until it expires. The first call after that is a trial: success
+    closes the breaker, failure opens it again for twice as long.
+    """
+
+    def __init__(self, api_key, threshold=5, cooldown=timedelta(minutes=1)):
+        self.__api_key = api_key
+        self.__threshold = threshold
+        self.__base_cooldown = cooldown
+        self.__cooldown = cooldown
+        self.__failures = 0
+        self.__open_until = None
+        self.__trial = False
+
+    @property
+    def is_open(self):
+        return self.__open_until is not None
+
+    @property
+    def in_trial(self):
+        return self.__trial
+
+    def allow(self):
+        """Whether a call may be made now; after expiry only one trial call."""
+        if self.__open_until is None:
+            return True
+        if self.__trial or dt_util.utcnow() < self.__open_until:
+            return False
+        self.__trial = True
+        return True
+
+    def retry_in(self):
+        """Time until the breaker lets a call through."""
+        if self.__open_until is None:
+            return timedelta(0)
+        return max(timedelta(0), self.__open_until - dt_util.utcnow())
+
+    def record_success(self):
+        if self.__open_until is not None:
+            _LOGGER.info("API key %s usable again.", self.__api_key[-4:])
+        self.__failures = 0
+        self.__cooldown = self.__base_cooldown
+        self.__open_until = None
+        self.__trial = False
+
+    def record_failure(self, wait_until=None):
+        """Count a failure; `wait_until` is the time the API asked us to wait for."""
+        self.__failures += 1
+        now = dt_util.utcnow()
+
+        if self.__trial:
+            self.__cooldown = min(self.__cooldown * 2, _MAX_COOLDOWN)
+        elif wait_until is None and self.__failures < self.__threshold:
+            return
+
+        open_until = now + self.__cooldown
+        if wait_until is not None:
+            open_until = (
+                max(open_until, wait_until) if self.__trial else wait_until
+            )
+        self.__open_until = open_until
+        self.__trial = False
+        _LOGGER.warning(
+            "API key %s: %s consecutive failures, no calls until %s.",
+            self.__api_key[-4:],
+            self.__failures,
+            open_until,
+        )
+
+
+class ClimacellExcludeSchedule:
+    """Minutes of the day in which a timeline must not be updated.
+
+    Each range is a start and an end, both included, given as "HH:MM" or
+    as "sunrise"/"sunset" with an optional offset in minutes ("sunset+30").
+    Further items restrict the range to weekdays ("mon-fri", "sat,sun").
+    The ranges are compiled into a minute-of-day table for each day, so
+    that sun relative ranges follow the season; the tables of the last
+    days are kept to measure the excluded time of the recent past.
+    """
+
+    def __init__(self, hass, ranges):
+        self.__hass = hass
+        self.__rules = []
+        self.__tables = {}
+
+        for value in ranges:
+            rule = _compile_range(value)
+            if rule is None:
+                _LOGGER.error("Invalid exclude_interval range: %s", value)
+            else:
+                self.__rules.append(rule)
+
+    def __len__(self):
+        return len(self.__rules)
+
+    def __sun_minute(self, event, offset, day):
+        when = get_astral_event_date(self.__hass, event, day)
+        if when is None:
+            return None
+        when = dt_util.as_local(when)
+        return when.hour * 60 + when.minute + offset
+
+    def __build(self, day):
+        minutes = bytearray(_MINUTES_PER_DAY)
+        weekday = day.weekday()
+        for start, end, weekdays in self.__rules:
+            if not weekdays & (1 << weekday):
+                continue
+            bounds = []
+            for kind, value in (start, end):
+                if kind is not None:
+                    value = self.__sun_minute(kind, value, day)
+                    if value is None:
+                        break
+                bounds.append(min(max(value, 0), _MINUTES_PER_DAY - 1))
+            else:
+                first, last = bounds
+                if first <= last:
+                    minutes[first : last + 1] = b"\x01" * (last - first + 1)
+                else:
+                    minutes[first:] = b"\x01" * (_MINUTES_PER_DAY - first)
+                    minutes[: last + 1] = b"\x01" * (last + 1)
+        return minutes
+
+    def __table(self, day):
+        minutes = self.__tables.get(day)
+        if minutes is None:
+            if len(self.__tables) >= _EXCLUDE_DAYS:
+                self.__tables.clear()
+            minutes = self.__tables[day] = self.__build(day)
+        return minutes
+
+    def is_excluded(self, now=None):
+        if not self.__rules:
+            return False
+        now = dt_util.as_local(dt_util.utcnow() if now is None else now)
+        return self.__table(now.date())[now.hour * 60 + now.minute] == 1
+
+    def excluded_time(self, start, end):
+        """Time between start and end in excluded minutes, up to _EXCLUDE_DAYS back."""
+        if not self.__rules or end <= start:
+            return timedelta(0)
+        end = dt_util.as_local(end)
+        start = max(dt_util.as_local(start), end - timedelta(days=_EXCLUDE_DAYS))
+
+        minutes = 0
+        day = start.date()
+        first = start.hour * 60 + start.minute
+        while day <= end.date():
+            last = (
+                end.hour * 60 + end.minute if day == end.date() else _MINUTES_PER_DAY
+            )
+            minutes += self.__table(day)[first:last].count(1)
+            first = 0
+            day += timedelta(days=1)
+        return timedelta(minutes=minutes)
+
+
+def _compile_time(value):
+    """(None, minute of day) or (sun event, offset in minutes)."""
+    value = value.strip().lower().replace(" ", "")
+    match = _TIME.match(value)
+    if match is not None:
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if hour > 24 or minute > 59:
+            return None
+        return None, min(hour * 60 + minute, _MINUTES_PER_DAY - 1)
+    match = _SUN.match(value)
+    if match is not None:
+        return match.group(1), int(match.group(2) or 0)
+    return None
+
+
+def _compile_weekdays(values):
+    """Bit mask of the weekdays (Monday is bit 0) named in the items."""
+    mask = 0
+    for value in values:
+        for item in value.lower().replace(" ", "").split(","):
+            first, _, last = item.partition("-")
+            if first not in _WEEKDAYS or (last and last not in _WEEKDAYS):
+                return None
+            first = _WEEKDAYS.index(first)
+            last = first if not last else _WEEKDAYS.index(last)
+            day = first
+            while True:
+                mask |= 1 << day
+                if day == last:
+                    break
+                day = (day + 1) % 7
+    return mask
+
+
+def _compile_range(value):
+    if len(value) < 2:
+        return None
+    start = _compile_time(value[0])
+    end = _compile_time(value[1])
+    weekdays = _compile_weekdays(value[2:]) if len(value) > 2 else _ALL_WEEKDAYS
+    if start is None or end is None or not weekdays:
+        return None
+    return start, end, weekdays
@@ -52,6 +52,11 @@ SCHEMA_TIMELINE = vol.Schema(
         vol.Optional(CONF_SCAN_INTERVAL): cv.time_period,
         vol.Optional(CONF_TIMESTEP, default="1d"): cv.string,
         vol.Optional(CONF_START_TIME, default=0): vol.Coerce(int),
+        vol.Optional(CONF_REFRESH_LAG): cv.time_period,
+        vol.Optional(CONF_REFRESH_JITTER): cv.time_period,
+        vol.Optional(CONF_MAX_STALENESS): cv.time_period,
+        vol.Optional(CONF_EXPIRE_AFTER): cv.time_period,
+        vol.Optional(CONF_SERIES, default=False): cv.boolean,
     }
 )
 
@@ -61,6 +66,9 @@ SCHEMA_EXTENSION = {
         vol.Optional(CONF_LONGITUDE): cv.longitude,
         vol.Optional(CONF_NAME, default=DEFAULT_NAME.lower()): cv.string,
         vol.Optional(CONF_UNITS): vol.In(CONF_ALLOWED_UNITS + CONF_LEGACY_UNITS),
+        vol.Optional(CONF_DAILY_LIMIT): cv.positive_int,
+        vol.Optional(CONF_HOURLY_LIMIT): cv.positive_int,
+        vol.Optional(CONF_DIAGNOSTICS, default=False): cv.boolean,
         vol.Optional(CONF_MONITORED_CONDITIONS): vol.Schema(
             MONITORED_CONDITIONS_SCHEMA
         ),
@@ -69,3 +77,25 @@ SCHEMA_EXTENSION = {
         ),
     }
 
+
+SCHEMA_WEATHER_EXTENSION = {
+        vol.Required(CONF_API_KEY): cv.string,
+        vol.Optional(CONF_LATITUDE): cv.latitude,
+        vol.Optional(CONF_LONGITUDE): cv.longitude,
+        vol.Optional(CONF_NAME, default=DEFAULT_NAME.lower()): cv.string,
+        vol.Optional(CONF_UNITS): vol.In(CONF_ALLOWED_UNITS + CONF_LEGACY_UNITS),
+        vol.Optional(CONF_DAILY_LIMIT): cv.positive_int,
+        vol.Optional(CONF_HOURLY_LIMIT): cv.positive_int,
+        vol.Optional(CONF_FORECAST_OBSERVATIONS, default=5): cv.positive_int,
+        vol.Optional(CONF_UPDATE): vol.All(cv.ensure_list, [vol.In(UPDATE_MODES)]),
+        vol.Optional(CONF_EXCLUDE_INTERVAL): vol.All(
+            cv.ensure_list, [vol.Schema(SCHEMA_EXCLUDE_INTERVAL)]
+        ),
+        vol.Optional(CONF_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_TIMESTEP, default="1d"): cv.string,
+        vol.Optional(CONF_START_TIME, default=0): vol.Coerce(int),
+        vol.Optional(CONF_REFRESH_LAG): cv.time_period,
+        vol.Optional(CONF_REFRESH_JITTER): cv.time_period,
+        vol.Optional(CONF_MAX_STALENESS): cv.time_period,
+        vol.Optional(CONF_EXPIRE_AFTER): cv.time_period,
+    }
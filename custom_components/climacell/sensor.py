@@ -1,9 +1,7 @@
 """Support for climacell.co"""
 
 import logging
-import re
-import pytz
-from datetime import datetime
+from types import MappingProxyType
 
 from custom_components.climacell.global_const import *
 from custom_components.climacell.schema_const import SCHEMA_EXTENSION
@@ -21,128 +19,203 @@ from homeassistant.const import (
     ATTR_NAME,
 )
 
-from . import DOMAIN, ClimacellTimelineDataProvider
+from . import DOMAIN
 from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.helpers.entity import Entity
+from homeassistant.core import callback
 from custom_components.climacell.lib import prepare_config
+from custom_components.climacell.entity import ClimacellEntity
+from custom_components.climacell.registry import async_first_refresh, get_registry
 
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(SCHEMA_EXTENSION)
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+# name suffix, unit, icon and value of the diagnostic sensors of each timeline
+METRIC_SENSORS = (
+    (
+        "fetch latency",
+        "ms",
+        "mdi:timer-outline",
+        lambda provider: provider.request_metrics.latency_ms,
+    ),
+    (
+        "response size",
+        "B",
+        "mdi:download-outline",
+        lambda provider: provider.request_metrics.response_bytes,
+    ),
+    (
+        "parse time",
+        "ms",
+        "mdi:code-json",
+        lambda provider: provider.request_metrics.parse_ms,
+    ),
+    (
+        "errors",
+        None,
+        "mdi:alert-circle-outline",
+        lambda provider: provider.request_metrics.error_count,
+    ),
+    (
+        "since last success",
+        "s",
+        "mdi:clock-check-outline",
+        lambda provider: provider.request_metrics.seconds_since_success,
+    ),
+    ("cache hits", None, "mdi:cached", lambda provider: provider.cache_hits),
+    (
+        "throttle skips",
+        None,
+        "mdi:timer-sand",
+        lambda provider: provider.throttle_skips,
+    ),
+)
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Climacell sensor."""
     
     _LOGGER.info("__init__ setup_platform 'sensor' start for %s.", DOMAIN)
 
     config = prepare_config(hass, config)
     
+    api_key = config.get(CONF_API_KEY)
+    registry = get_registry(hass)
+    registry.quota(api_key).set_limits(
+        config.get(CONF_DAILY_LIMIT), config.get(CONF_HOURLY_LIMIT)
+    )
+
+    planner = registry.planner(api_key)
+    data_providers = []
     sensors = []
     for timeline_spec in config[CONF_TIMELINES]:
         observations = timeline_spec[CONF_FORECAST_OBSERVATIONS]
-        data_provider = ClimacellTimelineDataProvider(
-            api_key=config.get(CONF_API_KEY),
-            latitude=config.get(CONF_LATITUDE),
-            longitude=config.get(CONF_LONGITUDE),
-            interval=timeline_spec[CONF_SCAN_INTERVAL],
-            units=config.get(CONF_UNITS),
-            fields=timeline_spec[CONF_FIELDS].keys(),
-            start_time=timeline_spec[CONF_START_TIME],
-            observations=observations,
-            timesteps=timeline_spec[CONF_TIMESTEP],
-            exceptions=timeline_spec[CONF_EXCLUDE_INTERVAL],
+        data_provider, created = registry.timeline_provider(
+            config,
+            timeline_spec,
+            {
+                field: field_values[ATTR_VALUE_MAP]
+                for field, field_values in timeline_spec[CONF_FIELDS].items()
+                if field_values[ATTR_VALUE_MAP] is not None
+            },
+            "sensor",
         )
 
-        data_provider.retrieve_update()
+        if created:
+            data_providers.append(data_provider)
+
+        if config[CONF_DIAGNOSTICS]:
+            for index, metric in enumerate(METRIC_SENSORS):
+                sensors.append(
+                    ClimacellMetricSensor(
+                        data_provider=data_provider,
+                        metric=metric,
+                        dump=index == 0,
+                    )
+                )
 
         for field in timeline_spec[CONF_FIELDS]:
             field_values = timeline_spec[CONF_FIELDS][field]
+            spec = ClimacellFieldSpec(
+                field=field,
+                condition_name=field_values[ATTR_CONDITION],
+                unit=field_values[ATTR_UNIT_OF_MEASUREMENT],
+                icon=field_values[ATTR_ICON],
+            )
+            if timeline_spec[CONF_SERIES]:
+                sensors.append(
+                    ClimacellSeriesSensor(
+                        data_provider=data_provider,
+                        spec=spec,
+                        sensor_friendly_name=timeline_spec[CONF_NAME]
+                        + " "
+                        + field_values[ATTR_NAME],
+                        timestep=timeline_spec[CONF_TIMESTEP],
+                    )
+                )
+                continue
             for observation in range(0, observations):
                 sensors.append(
                     ClimacellTimelineSensor(
                         data_provider=data_provider,
-                        field=field,
-                        condition_name=field_values[ATTR_CONDITION],
+                        spec=spec,
                         sensor_friendly_name=timeline_spec[CONF_NAME]
                         + " "
                         + field_values[ATTR_NAME],
                         timestep=timeline_spec[CONF_TIMESTEP],
                         observation=None if observations == 1 else observation,
-                        update=timeline_spec[CONF_UPDATE],
-                        unit=field_values[ATTR_UNIT_OF_MEASUREMENT],
-                        icon=field_values[ATTR_ICON],
                     )
                 )
-    add_entities(sensors, True)
+    planner.plan()
+    _LOGGER.debug(
+        "%s timelines planned into %s requests.",
+        len(data_providers),
+        len(planner.requests),
+    )
+
+    async_add_entities(sensors)
+    hass.async_create_task(async_first_refresh(data_providers))
 
     _LOGGER.info("__init__ setup_platform 'sensor' done for %s.", DOMAIN)
     return True
 
-class ClimacellTimelineSensor(Entity):
-    def __init__(
-        self,
-        data_provider,
-        field,
-        condition_name,
-        sensor_friendly_name,
-        timestep,
-        observation,
-        update,
-        unit,
-        icon,
-    ):
-        self.__data_provider = data_provider
-        self.__field = field
-        self._condition_name = condition_name
-        self._observation = observation
-        self.__update = update
-        self.__icon = icon
+def _sensor_name(sensor_friendly_name, timestep, observation):
+    friendly_name = "cc " + sensor_friendly_name
 
-        self.__friendly_name = "cc " + sensor_friendly_name
+    if timestep != "current":
+        timestep_suffix = timestep[-1]
+        timestep_int = int(timestep[:-1])
+        timestep_length = 1
+        if timestep_suffix == "m":
+            timestep_length = 2
 
-        if timestep == 'current':
-            self._observation = 0
+        if observation is None:
+            timestep_formatted = ""
         else:
-            timestep_suffix = timestep[-1]
-            timestep_int = int(timestep[:-1])
-            timestep_length = 1
-            if timestep_suffix == "m":
-                timestep_length = 2
-
-            if self._observation is None:
-                timestep_formatted = ""
-            else:
-                timestep_formatted = (
-                    str(timestep_int * (self._observation)).zfill(timestep_length)
-                    + timestep_suffix
-                )
+            timestep_formatted = (
+                str(timestep_int * observation).zfill(timestep_length)
+                + timestep_suffix
+            )
 
-            self.__friendly_name += " " + timestep_formatted
+        friendly_name += " " + timestep_formatted
 
-        if isinstance(unit, dict):
-            self._unit_of_measurement = None
-            self.__valuemap = unit
-        elif unit is None:
-            self._unit_of_measurement = None
-            self.__valuemap = None
-        else:
-            self._unit_of_measurement = unit
-            self.__valuemap = None
+    return friendly_name
 
-        self._state = None
-        self._observation_time = None
+
+class ClimacellFieldSpec:
+    """Settings shared by all observation sensors of a timeline field."""
+
+    __slots__ = ("field", "condition_name", "unit", "icon", "attributes")
+
+    def __init__(self, field, condition_name, unit, icon):
+        self.field = field
+        self.condition_name = condition_name
+        self.unit = None if isinstance(unit, dict) else unit
+        self.icon = icon
+        self.attributes = MappingProxyType(
+            {
+                ATTR_ATTRIBUTION: ATTRIBUTION,
+                ATTR_OBSERVATION_TIME: None,
+                ATTR_UNIT_OF_MEASUREMENT: self.unit,
+            }
+        )
+
+
+class ClimacellTimelineSensor(ClimacellEntity):
+    __slots__ = ("_spec", "__observation", "__friendly_name")
+
+    def __init__(
+        self, data_provider, spec, sensor_friendly_name, timestep, observation
+    ):
+        super().__init__(data_provider)
+        self._spec = spec
+        self.__observation = 0 if observation is None else observation
+        self.__friendly_name = self._friendly_name(
+            sensor_friendly_name, timestep, observation
+        )
 
     @staticmethod
-    def __to_float(value):
-        if type(value) == str:
-            if re.match(r"^-?\d+(?:\.\d+)?$", value) is None:
-                return value
-            elif re.search("^[1-9][0-9]{0,2}(?:,[0-9]{3}){0,3}$", value):
-                return int(value)
-            else:
-                return float(value)
-        else:
-            return value
+    def _friendly_name(sensor_friendly_name, timestep, observation):
+        return _sensor_name(sensor_friendly_name, timestep, observation)
 
     @property
     def name(self):
@@ -152,52 +225,104 @@ class ClimacellTimelineSensor(Entity):
     @property
     def icon(self):
         """Icon to use in the frontend, if any."""
-        return self.__icon
+        return self._spec.icon
 
     @property
     def state(self):
         """Return the state of the sensor."""
-        return self.__to_float(self._state)
+        data = self.coordinator.data
+        if data is None or self.__observation >= len(data):
+            return None
+        return data.values[self._spec.field][self.__observation]
 
     @property
     def device_state_attributes(self):
         """Return the state attributes."""
-        attrs = {
-            ATTR_ATTRIBUTION: ATTRIBUTION,
-            ATTR_OBSERVATION_TIME: self._observation_time,
-            ATTR_UNIT_OF_MEASUREMENT: self._unit_of_measurement,
-        }
-
-        return attrs
-
-    def update(self):
-        if ATTR_AUTO == self.__update:
-            self.__data_provider.retrieve_update()
-
-        if self.__data_provider.data is not None:
-            if (0 if self._observation is None else self._observation) >= len(self.__data_provider.data["intervals"]):
-                _LOGGER.error(
-                    "observation %s missing: %s",
-                    self._observation,
-                    self.__data_provider.data,
-                )
-                return
-
-            sensor_data = self.__data_provider.data["intervals"][(0 if self._observation is None else self._observation)]
-            self._state = sensor_data["values"][self.__field]
-            if self.__valuemap is not None:
-                self._state = self.__valuemap[str(self._state)]
-
-            self._observation_time = sensor_data["startTime"]
-            try:
-                dt = datetime.strptime(self._observation_time, "%Y-%m-%dT%H:%M:%S.%fZ")
-                utc = dt.replace(tzinfo=pytz.timezone("UTC"), microsecond=0, second=0)
-                local_dt = utc.astimezone(self.hass.config.time_zone)
-                self._observation_time = local_dt.isoformat()
-            except Exception as e:
-                pass
+        data = self.coordinator.data
+        if data is None or self.__observation >= len(data):
+            return self._spec.attributes
+        return data.attributes(self.__observation, self._spec.unit)
 
-        else:
+    @callback
+    def _handle_coordinator_update(self):
+        data = self.coordinator.data
+        if data is None:
             _LOGGER.warning(
                 "TimelineSensor.update - Provider has no data for: %s", self.name
             )
+        elif self.__observation >= len(data):
+            _LOGGER.error(
+                "observation %s missing for %s, provider has %s observations",
+                self.__observation,
+                self.name,
+                len(data),
+            )
+        super()._handle_coordinator_update()
+
+    def data_changed(self):
+        return self.coordinator.changed(self._spec.field, self.__observation)
+
+
+class ClimacellSeriesSensor(ClimacellTimelineSensor):
+    """First observation of a field, with the whole timeline as attribute."""
+
+    __slots__ = ()
+
+    def __init__(self, data_provider, spec, sensor_friendly_name, timestep):
+        super().__init__(data_provider, spec, sensor_friendly_name, timestep, None)
+
+    @staticmethod
+    def _friendly_name(sensor_friendly_name, timestep, observation):
+        """Named after the timestep of the series."""
+        friendly_name = "cc " + sensor_friendly_name
+        if timestep == "current":
+            return friendly_name
+        return friendly_name + " " + timestep
+
+    @property
+    def device_state_attributes(self):
+        """Return the state attributes."""
+        data = self.coordinator.data
+        if data is None or not len(data):
+            return self._spec.attributes
+        return data.series_attributes(self._spec.field, self._spec.unit)
+
+    def data_changed(self):
+        return self.coordinator.changed(self._spec.field)
+
+
+class ClimacellMetricSensor(ClimacellEntity):
+    """Diagnostic counter of a timeline and of the request fetching it."""
+
+    def __init__(self, data_provider, metric, dump=False):
+        super().__init__(data_provider)
+        self.__name, self.__unit, self.__icon, self.__value = metric
+        self.__dump = dump
+
+    @property
+    def name(self):
+        return "cc " + self.coordinator.name + " " + self.__name
+
+    @property
+    def icon(self):
+        return self.__icon
+
+    @property
+    def unit_of_measurement(self):
+        return self.__unit
+
+    @property
+    def state(self):
+        if self.coordinator.request_metrics is None:
+            return None
+        return self.__value(self.coordinator)
+
+    @property
+    def available(self):
+        return True
+
+    @property
+    def device_state_attributes(self):
+        if self.__dump:
+            return self.coordinator.metrics
+        return None
@@ -0,0 +1,229 @@
+"""Weather entity of a climacell.co timeline"""
+
+import logging
+
+from custom_components.climacell.global_const import *
+from custom_components.climacell.schema_const import SCHEMA_WEATHER_EXTENSION
+
+from homeassistant.components.google_assistant import CONF_API_KEY
+from homeassistant.components.weather import (
+    ATTR_CONDITION_CLEAR_NIGHT,
+    ATTR_FORECAST_CONDITION,
+    ATTR_FORECAST_TEMP,
+    ATTR_FORECAST_TEMP_LOW,
+    ATTR_FORECAST_TIME,
+    ATTR_FORECAST_WIND_BEARING,
+    ATTR_FORECAST_WIND_SPEED,
+    PLATFORM_SCHEMA,
+    WeatherEntity,
+)
+from homeassistant.const import (
+    CONF_NAME,
+    CONF_SCAN_INTERVAL,
+    TEMP_CELSIUS,
+    TEMP_FAHRENHEIT,
+)
+from homeassistant.helpers.sun import is_up
+
+from . import DOMAIN
+from custom_components.climacell.entity import ClimacellEntity
+from custom_components.climacell.lib import prepare_config
+from custom_components.climacell.registry import async_first_refresh, get_registry
+
+_LOGGER = logging.getLogger(__name__)
+
+PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(SCHEMA_WEATHER_EXTENSION)
+
+# options of the single timeline behind the weather entity
+TIMELINE_OPTIONS = (
+    CONF_FORECAST_OBSERVATIONS,
+    CONF_UPDATE,
+    CONF_EXCLUDE_INTERVAL,
+    CONF_SCAN_INTERVAL,
+    CONF_TIMESTEP,
+    CONF_START_TIME,
+    CONF_REFRESH_LAG,
+    CONF_REFRESH_JITTER,
+    CONF_MAX_STALENESS,
+    CONF_EXPIRE_AFTER,
+)
+
+WEATHER_FIELDS = [
+    "weatherCode",
+    "temperature",
+    "humidity",
+    "pressureSeaLevel",
+    "windSpeed",
+    "windDirection",
+    "visibility",
+    "precipitationIntensity",
+    "precipitationProbability",
+]
+
+# the weather entity expects km/h with metric units, climacell returns m/s
+WIND_SPEED_FACTORS = {
+    CONF_ALLOWED_UNITS[0]: 3.6,
+    CONF_ALLOWED_UNITS[1]: 1,
+}
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Set up the Climacell weather entity."""
+
+    _LOGGER.info("__init__ setup_platform 'weather' start for %s.", DOMAIN)
+
+    daily = config[CONF_TIMESTEP].endswith("d")
+    timeline = {key: config[key] for key in TIMELINE_OPTIONS if key in config}
+    config = {
+        key: value for key, value in config.items() if key not in TIMELINE_OPTIONS
+    }
+    timeline[CONF_NAME] = None
+    timeline[CONF_FIELDS] = WEATHER_FIELDS + (["temperatureMin"] if daily else [])
+    config[CONF_TIMELINES] = [timeline]
+    config = prepare_config(hass, config)
+
+    api_key = config.get(CONF_API_KEY)
+    registry = get_registry(hass)
+    registry.quota(api_key).set_limits(
+        config.get(CONF_DAILY_LIMIT), config.get(CONF_HOURLY_LIMIT)
+    )
+
+    timeline_spec = config[CONF_TIMELINES][0]
+    data_provider, created = registry.timeline_provider(
+        config, timeline_spec, {"weatherCode": WEATHER_CONDITIONS}, "weather"
+    )
+    registry.planner(api_key).plan()
+
+    async_add_entities(
+        [
+            ClimacellWeather(
+                data_provider=data_provider,
+                name=timeline_spec[CONF_NAME],
+                units=config[CONF_UNITS],
+                daily=daily,
+            )
+        ]
+    )
+    if created:
+        hass.async_create_task(async_first_refresh([data_provider]))
+
+    _LOGGER.info("__init__ setup_platform 'weather' done for %s.", DOMAIN)
+    return True
+
+
+class ClimacellWeather(ClimacellEntity, WeatherEntity):
+    """Current conditions and forecast of a whole timeline in one entity.
+
+    The state comes from the first observation, the forecast list from
+    all of them.
+    """
+
+    def __init__(self, data_provider, name, units, daily):
+        super().__init__(data_provider)
+        self.__name = "cc " + name
+        self.__metric = units == CONF_ALLOWED_UNITS[0]
+        self.__wind_factor = WIND_SPEED_FACTORS[units]
+        self.__daily = daily
+        self.__forecast = None
+
+    def __value(self, field, observation=0):
+        data = self.coordinator.data
+        if data is None or observation >= len(data):
+            return None
+        return data.values[field][observation]
+
+    def __wind_speed(self, observation=0):
+        speed = self.__value("windSpeed", observation)
+        if speed is None:
+            return None
+        return round(speed * self.__wind_factor, 2)
+
+    def __condition(self, observation=0):
+        condition = self.__value("weatherCode", observation)
+        if condition not in WEATHER_CONDITIONS.values():
+            return None
+        if (
+            condition == ATTR_CONDITION_SUNNY
+            and not self.__daily
+            and not is_up(self.hass, self.coordinator.data.start_times[observation])
+        ):
+            return ATTR_CONDITION_CLEAR_NIGHT
+        return condition
+
+    def data_changed(self):
+        return self.coordinator.changed()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def attribution(self):
+        return ATTRIBUTION
+
+    @property
+    def condition(self):
+        return self.__condition()
+
+    @property
+    def temperature(self):
+        return self.__value("temperature")
+
+    @property
+    def temperature_unit(self):
+        return TEMP_CELSIUS if self.__metric else TEMP_FAHRENHEIT
+
+    @property
+    def pressure(self):
+        return self.__value("pressureSeaLevel")
+
+    @property
+    def humidity(self):
+        return self.__value("humidity")
+
+    @property
+    def wind_speed(self):
+        return self.__wind_speed()
+
+    @property
+    def wind_bearing(self):
+        return self.__value("windDirection")
+
+    @property
+    def visibility(self):
+        return self.__value("visibility")
+
+    @property
+    def forecast(self):
+        """Forecast list, built once for each data of the provider."""
+        data = self.coordinator.data
+        if data is None:
+            return None
+        if self.__forecast is None or self.__forecast[0] is not data:
+            values = data.values
+            no_values = [None] * len(data)
+            self.__forecast = (
+                data,
+                [
+                    {
+                        ATTR_FORECAST_TIME: data.observation_times[observation],
+                        ATTR_FORECAST_CONDITION: self.__condition(observation),
+                        ATTR_FORECAST_TEMP: values["temperature"][observation],
+                        ATTR_FORECAST_TEMP_LOW: values.get(
+                            "temperatureMin", no_values
+                        )[observation],
+                        ATTR_FORECAST_PRECIPITATION: values["precipitationIntensity"][
+                            observation
+                        ],
+                        ATTR_FORECAST_PRECIPITATION_PROBABILITY: values[
+                            "precipitationProbability"
+                        ][observation],
+                        ATTR_FORECAST_WIND_SPEED: self.__wind_speed(observation),
+                        ATTR_FORECAST_WIND_BEARING: values["windDirection"][
+                            observation
+                        ],
+                    }
+                    for observation in range(len(data))
+                ],
+            )
+        return self.__forecast[1]
@@ -0,0 +1,222 @@
+"""Tests of the request planner: timestep choice, window and timeline views."""
+
+from datetime import datetime, timedelta
+import asyncio
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+import homeassistant.util.dt as dt_util
+
+from custom_components.climacell.data_provider import (
+    ClimacellRequestPlanner,
+    ClimacellTimeline,
+    ClimacellTimelineDataProvider,
+    _plan_timestep,
+    _plan_window,
+    _view_start,
+)
+from custom_components.climacell.scheduler import (
+    ClimacellCircuitBreaker,
+    ClimacellQuotaScheduler,
+)
+
+
+@pytest.mark.parametrize(
+    "timestep, api_timestep, api_step, take_every",
+    [
+        ("current", "current", None, 1),
+        ("1m", "1m", timedelta(minutes=1), 1),
+        ("7m", "1m", timedelta(minutes=1), 7),
+        ("45m", "15m", timedelta(minutes=15), 3),
+        ("60m", "1h", timedelta(hours=1), 1),
+        ("120m", "1h", timedelta(hours=1), 2),
+        ("180m", "1h", timedelta(hours=1), 3),
+        ("24h", "1d", timedelta(days=1), 1),
+        ("2d", "1d", timedelta(days=1), 2),
+    ],
+)
+def test_plan_timestep(timestep, api_timestep, api_step, take_every):
+    assert _plan_timestep(timestep) == (api_timestep, api_step, take_every)
+
+
+@pytest.mark.parametrize(
+    "timestep, observations, start_time, end_delta",
+    [
+        # last interval used plus one minute
+        ("1h", 1, 0, timedelta(minutes=1)),
+        ("1h", 5, 0, timedelta(hours=4, minutes=1)),
+        ("180m", 8, 0, timedelta(hours=21, minutes=1)),
+        ("45m", 4, 0, timedelta(hours=2, minutes=16)),
+        ("2d", 3, 0, timedelta(days=4, minutes=1)),
+        # clipped to the forecast horizon
+        ("1h", 200, 0, timedelta(hours=108)),
+        ("1d", 20, 0, timedelta(days=15)),
+        ("5m", 100, 0, timedelta(hours=6)),
+        ("1h", 200, 600, timedelta(hours=98)),
+        # starting in the past leaves more of the horizon
+        ("1h", 200, -120, timedelta(hours=110)),
+        ("1h", 5, -120, timedelta(hours=4, minutes=1)),
+        # starting past the horizon falls back to the default window
+        ("5m", 10, 360, None),
+    ],
+)
+def test_plan_window(timestep, observations, start_time, end_delta):
+    api_timestep, api_step, take_every = _plan_timestep(timestep)
+    assert (
+        _plan_window(api_timestep, api_step, take_every, observations, start_time)
+        == end_delta
+    )
+
+
+def test_plan_window_current_and_default():
+    assert _plan_window("current", None, 1, None, 0) is None
+    assert _plan_window("1h", timedelta(hours=1), 1, None, 0) is None
+
+
+def _run(test):
+    async def run():
+        hass = HomeAssistant()
+        try:
+            await test(hass)
+        finally:
+            await hass.async_stop(force=True)
+
+    asyncio.run(run())
+
+
+def _provider(hass, planner, name, timestep, observations, start_time, fields):
+    return ClimacellTimelineDataProvider(
+        hass=hass,
+        planner=planner,
+        name=name,
+        api_key="test",
+        latitude=45.0,
+        longitude=9.0,
+        interval=timedelta(minutes=5),
+        units="metric",
+        fields=fields,
+        start_time=start_time,
+        timesteps=timestep,
+        observations=observations,
+    )
+
+
+def _planner(hass):
+    return ClimacellRequestPlanner(
+        hass, ClimacellQuotaScheduler("test"), ClimacellCircuitBreaker("test")
+    )
+
+
+def test_shared_timestep_merges_fields_and_window():
+    async def test(hass):
+        planner = _planner(hass)
+        first = _provider(hass, planner, "a", "1h", 3, 0, ["temperature"])
+        second = _provider(hass, planner, "b", "120m", 2, 120, ["humidity"])
+        planner.plan()
+
+        assert len(planner.requests) == 1
+        assert first.request is second.request
+        assert first.request.start_time == 0
+        assert first.request.fields == "temperature,humidity"
+        # the later timeline uses the intervals at 2h and 4h
+        assert first.request.end_delta == timedelta(hours=4, minutes=1)
+
+    _run(test)
+
+
+def test_view_start_of_later_start_time():
+    fetched = datetime(2021, 2, 1, 12, 0, 30, tzinfo=dt_util.UTC)
+    start_times = [
+        fetched.replace(second=0) + timedelta(hours=hour) for hour in range(6)
+    ]
+    timeline = ClimacellTimeline(
+        start_times,
+        [start_time.isoformat() for start_time in start_times],
+        {"temperature": list(range(6))},
+    )
+
+    # intervals ending before the later startTime are skipped
+    start = _view_start(start_times, fetched, 120, timedelta(hours=1))
+    assert start == 2
+    view = timeline.view(start, 1, 2, ["temperature"])
+    assert view.start_times == start_times[2:4]
+    assert view.values == {"temperature": [2, 3]}
+
+
+def test_view_takes_every_nth_interval():
+    start_times = [
+        datetime(2021, 2, 1, hour, tzinfo=dt_util.UTC) for hour in range(10)
+    ]
+    timeline = ClimacellTimeline(
+        start_times,
+        [start_time.isoformat() for start_time in start_times],
+        {"temperature": list(range(10))},
+    )
+
+    view = timeline.view(0, 3, 3, ["temperature", "dewPoint"])
+    assert view.start_times == start_times[0:9:3]
+    assert view.values == {
+        "temperature": [0, 3, 6],
+        "dewPoint": [None, None, None],
+    }
+
+
+def test_timesteps_merge_with_union_of_fields():
+    async def test(hass):
+        planner = _planner(hass)
+        hourly = _provider(hass, planner, "a", "1h", 5, 0, ["temperature"])
+        daily = _provider(hass, planner, "b", "1d", 5, 0, ["humidity", "temperature"])
+        nowcast = _provider(hass, planner, "c", "5m", 5, 0, ["temperature"])
+        planner.plan()
+
+        assert hourly.request is daily.request
+        assert hourly.request.timesteps == ["1h", "1d"]
+        assert nowcast.request is not daily.request
+        assert len(planner.requests) == 2
+
+    _run(test)
+
+
+def test_restricted_fields_keep_their_own_call():
+    async def test(hass):
+        planner = _planner(hass)
+        hourly = _provider(hass, planner, "a", "1h", 5, 0, ["temperature"])
+        daily = _provider(hass, planner, "b", "1d", 5, 0, ["humidity"])
+        aggregate = _provider(hass, planner, "c", "2d", 3, 0, ["temperatureMax"])
+        planner.plan()
+
+        assert daily.request is aggregate.request
+        assert daily.request.timesteps == ["1d"]
+        assert hourly.request is not daily.request
+
+    _run(test)
+
+
+@pytest.mark.parametrize(
+    "timelines, end_delta",
+    [
+        # the longest window of the timesteps starting now
+        ([("1h", 5), ("1h", 3), ("current", None)], timedelta(hours=4, minutes=1)),
+        ([("1h", 5), ("1d", 5), ("180m", 8)], timedelta(days=4, minutes=1)),
+        ([("1h", 5), ("30m", 200)], timedelta(hours=6)),
+        # a timeline without window falls back to the default one
+        ([("1h", 5), ("1d", None)], None),
+        ([("current", None)], None),
+    ],
+)
+def test_merged_timesteps_window(timelines, end_delta):
+    async def test(hass):
+        planner = _planner(hass)
+        providers = [
+            _provider(
+                hass, planner, str(index), timestep, observations, 0, ["temperature"]
+            )
+            for index, (timestep, observations) in enumerate(timelines)
+        ]
+        planner.plan()
+
+        assert len(planner.requests) == 1
+        assert providers[0].request.end_delta == end_delta
+
+    _run(test)
@@ -0,0 +1,74 @@
+"""Tests of the timeline data provider: pushes to the sensors and expiry."""
+
+from datetime import timedelta
+import asyncio
+import tempfile
+
+import homeassistant.util.dt as dt_util
+
+from benchmarks.run import _create_hass
+from benchmarks.timelines_server import TimelinesStandIn
+import custom_components.climacell.data_provider as data_provider
+from custom_components.climacell import sensor
+
+
+def test_refresh_after_expiry_writes_available(monkeypatch):
+    monkeypatch.setattr(data_provider, "_PUBLISH_DELAY", 0.1)
+
+    async def test():
+        stand_in = TimelinesStandIn()
+        monkeypatch.setattr(data_provider, "_ENDPOINT", await stand_in.start())
+        hass = _create_hass(tempfile.mkdtemp())
+        entities = []
+        config = sensor.PLATFORM_SCHEMA(
+            {
+                "platform": "climacell",
+                "api_key": "test",
+                "units": "metric",
+                "timelines": [
+                    {
+                        "name": "test",
+                        "timestep": "1h",
+                        "forecast_observations": 1,
+                        "update": "manual",
+                        "expire_after": {"seconds": 1},
+                        "fields": ["temperature"],
+                    }
+                ],
+            }
+        )
+        try:
+            await sensor.async_setup_platform(hass, config, entities.extend)
+            entity = entities[0]
+            writes = []
+            entity.hass = hass
+            entity.entity_id = "sensor.test"
+            entity.async_write_ha_state = lambda: writes.append(entity.available)
+            await entity.async_added_to_hass()
+
+            await entity.coordinator.async_refresh()
+            await asyncio.sleep(0.3)
+            assert writes == [True]
+
+            # past the manual interval, the expiry timer writes unavailable
+            utcnow = dt_util.utcnow
+            monkeypatch.setattr(
+                dt_util, "utcnow", lambda: utcnow() + timedelta(minutes=10)
+            )
+            await asyncio.sleep(2.5)
+            assert writes == [True, False]
+
+            # the same data again is written since the availability changed
+            calls = stand_in.calls
+            await entity.coordinator.async_refresh()
+            await asyncio.sleep(0.3)
+            assert stand_in.calls == calls + 1
+            assert entity.available
+            assert writes == [True, False, True]
+
+            await entity.async_will_remove_from_hass()
+        finally:
+            await stand_in.stop()
+            await hass.async_stop(force=True)
+
+    asyncio.run(test())